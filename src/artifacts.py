@@ -0,0 +1,159 @@
+import datetime
+import json
+import os
+import pickle
+import re
+import numpy as np
+import src.kernels as kernels
+
+format_version = 1
+
+
+def get_artifact_path(root, name, version=None):
+    """
+    :param root: directory of all artifacts
+    :param name: name of the artifact, e.g. 'sepsis_complete_Admission IC'
+    :param version: version of the artifact. by default none, then the latest version
+    :return: directory of the artifact version, none if no version exists
+    """
+    if version is None:
+        if not os.path.isdir(os.path.join(root, name)):
+            return None
+        # only finished versions, no half-written '.tmp' directories or other files
+        versions = [int(v[1:]) for v in os.listdir(os.path.join(root, name)) if re.fullmatch(r'v\d+', v)]
+        if not versions:
+            return None
+        version = max(versions)
+
+    return os.path.join(root, name, f'v{version:04d}')
+
+
+def save_model_artifact(root, name, model, mode, scalers, seq_features, static_features, hps, max_len, masking=False,
+                        matrix_format="dense", static_baseline=None):
+    """
+    Saves a trained model with everything needed to score new cases as a new version of an artifact.
+    Lstm models are stored as their weights, so they can be scored without tensorflow (see kernels.predict_lstm).
+    :param root: directory of all artifacts
+    :param name: name of the artifact
+    :param model: trained keras model (see lstm.build_model) or sklearn classifier
+    :param mode: architecture of the lstm model or name of the classifier (e.g. "rf")
+    :param scalers: dictionary of normalization constants (see data.fit_sepsis_scalers)
+    :param seq_features: list of sequence features
+    :param static_features: list of static features
+    :param hps: hyperparameters of the model
+    :param max_len: number of time steps of the sequential input
+    :param masking: if true, the lstm model was built with masking
+    :param matrix_format: format of the feature matrix of a sklearn classifier (see features.concatenate_tensor_matrix)
+    :param static_baseline: by default none. baseline of the static attributions of an lstm model (see
+        explain_static), e.g. the mean static features of the training data
+    :return: directory of the saved version
+    """
+    latest_path = get_artifact_path(root, name)
+    version = 1 if latest_path is None else int(os.path.basename(latest_path)[1:]) + 1
+    path = get_artifact_path(root, name, version)
+    os.makedirs(path + '.tmp')
+
+    kind = "lstm" if mode in ["complete", "static", "sequential"] else "sklearn"
+    meta = {'format_version': format_version,
+            'version': version,
+            'created': datetime.datetime.now().isoformat(),
+            'kind': kind,
+            'mode': mode,
+            'max_len': max_len,
+            'masking': masking,
+            'matrix_format': matrix_format,
+            'scalers': {key: float(value) for key, value in scalers.items()},
+            'seq_features': list(seq_features),
+            'static_features': list(static_features),
+            'hps': hps,
+            'static_baseline': None if static_baseline is None else [float(x) for x in static_baseline]}
+
+    with open(os.path.join(path + '.tmp', 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    if kind == "lstm":
+        np.savez(os.path.join(path + '.tmp', 'weights.npz'), *model.get_weights())
+    else:
+        with open(os.path.join(path + '.tmp', 'model.pkl'), 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(path + '.tmp', path)  # no half-written versions if the run is interrupted
+
+    return path
+
+
+def load_model_artifact(root, name, version=None):
+    """
+    Loads a version of an artifact saved by save_model_artifact.
+    :param root: directory of all artifacts
+    :param name: name of the artifact
+    :param version: version of the artifact. by default none, then the latest version
+    :return: dictionary of the metadata of the artifact (see save_model_artifact) with its model
+        model : list of weights of an lstm model or sklearn classifier
+    """
+    path = get_artifact_path(root, name, version)
+    if path is None or not os.path.isdir(path):
+        raise FileNotFoundError(f'No artifact {name} (version {version}) in {root}')
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        artifact = json.load(f)
+    if artifact['format_version'] > format_version:
+        raise ValueError(f'Artifact format {artifact["format_version"]} is newer than {format_version}')
+
+    if artifact['kind'] == "lstm":
+        with np.load(os.path.join(path, 'weights.npz')) as f:
+            artifact['model'] = [f[f'arr_{i}'] for i in range(len(f.files))]
+    else:
+        with open(os.path.join(path, 'model.pkl'), 'rb') as f:
+            artifact['model'] = pickle.load(f)
+
+    return artifact
+
+
+def predict_proba(artifact, x_seq, x_stat):
+    """
+    Scores encoded prefixes with the model of an artifact.
+    :param artifact: artifact loaded by load_model_artifact
+    :param x_seq: one-hot sequential dataset (prefixes x max_len x features)
+    :param x_stat: static dataset
+    :return: predicted probabilities of the positive class
+    """
+    if artifact['kind'] == "lstm":
+        return kernels.predict_lstm(artifact['model'], x_seq, x_stat, artifact['mode'], artifact['masking'])
+    else:
+        import src.features as features
+        x_concat = features.concatenate_tensor_matrix(x_seq, x_stat, artifact['matrix_format'])
+
+        return artifact['model'].predict_proba(x_concat)[:, 1]
+
+
+def explain_static(artifact, x_stat):
+    """
+    Computes the exact shap values of the static features with the model of an artifact, without tensorflow or an
+    explainer (see kernels.get_static_attributions).
+    :param artifact: artifact of an lstm model of mode "complete" or "static", saved with a static baseline
+    :param x_stat: static dataset
+    :return: shap values in logit space (prefixes x static features)
+    """
+    if artifact['kind'] != "lstm" or artifact['mode'] not in ["complete", "static"]:
+        raise ValueError(f'Static attributions need an lstm model with static input, not {artifact["mode"]}')
+    if artifact.get('static_baseline') is None:
+        raise ValueError('The artifact was saved without a static baseline')
+
+    return kernels.get_static_attributions(artifact['model'], x_stat, artifact['static_baseline'])
+
+
+def get_keras_model(artifact):
+    """
+    Rebuilds the keras model of an lstm artifact, e.g. to continue training it.
+    :param artifact: artifact loaded by load_model_artifact
+    :return: compiled keras model with the weights of the artifact
+    """
+    import src.lstm as lstm
+
+    hps = artifact['hps']
+    model = lstm.build_model(artifact['mode'], hps.get("size"), hps["learning_rate"], artifact['max_len'],
+                             len(artifact['seq_features']), len(artifact['static_features']),
+                             masking=artifact['masking'])
+    model.set_weights(artifact['model'])
+
+    return model
@@ -0,0 +1,190 @@
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+import src.hpo as hpo
+import src.kernels as kernels
+import src.prefixes as prefixes
+import src.util as util
+
+lstm = util.lazy_import('src.lstm')
+
+attribution_names = ['x_seq', 'x_stat', 'shap_seq', 'shap_stat']
+
+
+def get_prefix_rows(x_seq, x_stat, rows, max_len):
+    """
+    :param x_seq: sequential dataset or prefix store (see prefixes.create_prefix_store)
+    :param x_stat: static dataset. not used for a prefix store
+    :param rows: sorted indices of the prefixes
+    :param max_len: number of time steps of prefixes padded from a prefix store
+    :return: dense sequential and static arrays of the selected prefixes
+    """
+    if isinstance(x_seq, dict):
+        return prefixes.get_prefix_batch(x_seq, rows, max_len)[:2]
+
+    return np.asarray(x_seq[rows], dtype=np.float32), np.asarray(x_stat[rows], dtype=np.float32)
+
+
+def get_background(x_seq, x_stat, y, size=100, method="kmeans", max_len=None, max_samples=10000, random_state=0):
+    """
+    Summarizes the training prefixes by a small background dataset for shap.DeepExplainer.
+    :param x_seq: sequential training dataset or prefix store
+    :param x_stat: static training dataset. not used for a prefix store
+    :param y: target attribute of the training prefixes
+    :param size: number of background samples
+    :param method: "kmeans": cluster centers of the prefixes (sequential and static features) | "stratified":
+        stratified sample of the prefixes
+    :param max_len: number of time steps of prefixes padded from a prefix store
+    :param max_samples: maximal number of prefixes the clusters are fitted on, a stratified sample of them
+    :param random_state: seed of the samples and the clustering
+    :return: sequential and static background arrays
+    """
+    y = np.ravel(y)
+    num_samples = size if method == "stratified" else max_samples
+    x_seq_sample, x_stat_sample = get_prefix_rows(x_seq, x_stat, hpo.get_subsample(y, num_samples / len(y),
+                                                                                    random_state), max_len)
+    if method == "stratified":
+        return x_seq_sample, x_stat_sample
+
+    x_flat = np.concatenate([x_seq_sample.reshape(len(x_seq_sample), -1), x_stat_sample], axis=1)
+    centers = MiniBatchKMeans(n_clusters=size, random_state=random_state).fit(x_flat).cluster_centers_
+
+    return (centers[:, :x_seq_sample[0].size].reshape((size,) + x_seq_sample.shape[1:]).astype(np.float32),
+            centers[:, x_seq_sample[0].size:].astype(np.float32))
+
+
+def create_attribution_files(path, num_prefixes, max_len, num_features_seq, num_features_stat):
+    """
+    Creates the memory-mapped files the inputs and shap values of the explained prefixes are written to.
+    :param path: path prefix of the files
+    :param num_prefixes: number of explained prefixes
+    :param max_len: number of time steps of the sequential input
+    :param num_features_seq: number of sequential features
+    :param num_features_stat: number of static features
+    :return: dictionary of the file paths, keys attribution_names
+    """
+    shapes = {'x_seq': (num_prefixes, max_len, num_features_seq), 'x_stat': (num_prefixes, num_features_stat),
+              'shap_seq': (num_prefixes, max_len, num_features_seq), 'shap_stat': (num_prefixes, num_features_stat)}
+
+    paths = {}
+    for name in attribution_names:
+        paths[name] = f'{path}_{name}.npy'
+        np.lib.format.open_memmap(paths[name], mode='w+', dtype=np.float32, shape=shapes[name]).flush()
+
+    return paths
+
+
+def explain_part(model, mode, background, x_seq, x_stat, rows, positions, paths, max_len, chunk_size,
+                 static_attribution="deep"):
+    """
+    Explains prefixes chunk by chunk and writes every chunk to the attribution files.
+    :param model: model with one-hot sequential input or (json, weights) tuple of it, then the model is rebuilt (worker
+        process)
+    :param mode: architecture of the model (see lstm.get_inputs)
+    :param background: sequential and static background arrays (see get_background)
+    :param x_seq: sequential dataset or prefix store
+    :param x_stat: static dataset. not used for a prefix store
+    :param rows: sorted indices of the prefixes to explain
+    :param positions: positions of the prefixes in the attribution files
+    :param paths: paths of the attribution files (see create_attribution_files)
+    :param max_len: number of time steps of prefixes padded from a prefix store
+    :param chunk_size: number of prefixes explained at once
+    :param static_attribution: "deep": all inputs are explained by the explainer, values in probability space |
+        "analytic": the shap values of the static features are computed in closed form (see
+        kernels.get_static_attributions), the explainer only explains the sequential input. values in logit space
+    """
+    import shap
+
+    if isinstance(model, tuple):
+        model_json, weights = model
+        model = lstm.tf.keras.models.model_from_json(model_json)
+        model.set_weights(weights)
+
+    analytic = static_attribution == "analytic" and mode in ["complete", "static"]
+    if analytic:  # shap values in logit space
+        weights, baseline = model.get_weights(), background[1].mean(axis=0)
+        explainer = shap.DeepExplainer(lstm.get_sequential_logit_model(model), background[0]) \
+            if mode == "complete" else None
+    else:
+        explainer = shap.DeepExplainer(model, lstm.get_inputs(background[0], background[1], mode))
+        num_inputs = len(lstm.get_inputs(background[0], background[1], mode))
+
+    files = {name: np.load(paths[name], mmap_mode='r+') for name in attribution_names}
+    for start in range(0, len(rows), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        x_seq_chunk, x_stat_chunk = get_prefix_rows(x_seq, x_stat, rows[chunk], max_len)
+        if analytic:
+            shap_values = [explainer.shap_values(x_seq_chunk)[0] if explainer is not None else None,
+                           kernels.get_static_attributions(weights, x_stat_chunk, baseline)]
+        else:
+            shap_values = explainer.shap_values(lstm.get_inputs(x_seq_chunk, x_stat_chunk, mode))[0]  # single output
+            shap_values = shap_values if num_inputs > 1 else [shap_values]
+
+        files['x_seq'][positions[chunk]] = x_seq_chunk
+        files['x_stat'][positions[chunk]] = x_stat_chunk
+        if mode in ["complete", "sequential"]:
+            files['shap_seq'][positions[chunk]] = shap_values[0]
+        if mode in ["complete", "static"]:
+            files['shap_stat'][positions[chunk]] = shap_values[-1]
+        for name in attribution_names:
+            files[name].flush()
+
+
+def explain(model, mode, x_seq, x_stat, y, path, max_len, background="kmeans", background_size=100, chunk_size=256,
+            n_jobs=1, max_prefixes=None, static_attribution="deep"):
+    """
+    Explains the predictions of an lstm model for its training prefixes with shap.DeepExplainer.
+    The prefixes are explained in chunks, split across worker processes; every chunk is written to memory-mapped
+    files right away, so the memory does not grow with the number of prefixes.
+    :param model: trained model with one-hot sequential input (see lstm.build_model and lstm.get_dense_model)
+    :param mode: architecture of the model
+    :param x_seq: sequential training dataset or prefix store
+    :param x_stat: static training dataset. not used for a prefix store
+    :param y: target attribute of the training prefixes
+    :param path: path prefix of the attribution files
+    :param max_len: number of time steps of the sequential input
+    :param background: method summarizing the training prefixes as background (see get_background)
+    :param background_size: number of background samples
+    :param chunk_size: number of prefixes explained at once
+    :param n_jobs: number of worker processes (-1: one per core)
+    :param max_prefixes: by default none (all prefixes). if set, a stratified sample of this many prefixes is explained
+    :param static_attribution: "analytic" | "deep" (see explain_part)
+    :return: dictionary of the paths of the attribution files (see load_attributions)
+    """
+    y = np.ravel(y)
+    rows = np.arange(len(y)) if max_prefixes is None else hpo.get_subsample(y, max_prefixes / len(y))
+    background_data = get_background(x_seq, x_stat, y, background_size, background, max_len)
+
+    paths = create_attribution_files(path, len(rows), max_len, background_data[0].shape[2],
+                                     background_data[1].shape[1])
+    parts = np.array_split(np.arange(len(rows)), joblib.effective_n_jobs(n_jobs))
+    model = model if n_jobs == 1 else (model.to_json(), model.get_weights())  # a model cannot be passed to a worker
+
+    joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(explain_part)(model, mode, background_data, x_seq, x_stat, rows[positions], positions, paths,
+                                     max_len, chunk_size, static_attribution)
+        for positions in parts if len(positions))
+
+    return paths
+
+
+def load_attributions(path, seq_features):
+    """
+    Reads the sequential shap values written by explain as a table of the non-padded time steps.
+    :param path: path prefix of the attribution files
+    :param seq_features: list of sequence features
+    :return: dataframe with the values of the sequence features and their shap values (columns 'SHAP <feature>')
+    """
+    x_seq = np.load(f'{path}_x_seq.npy', mmap_mode='r')
+    shap_seq = np.load(f'{path}_shap_seq.npy', mmap_mode='r')
+
+    frames = []
+    for start in range(0, len(x_seq), prefixes.chunk_size):
+        x_chunk = x_seq[start: start + prefixes.chunk_size].reshape(-1, len(seq_features))
+        shap_chunk = shap_seq[start: start + prefixes.chunk_size].reshape(-1, len(seq_features))
+        events = x_chunk.any(axis=1)
+        frames.append(pd.DataFrame(np.concatenate([x_chunk[events], shap_chunk[events]], axis=1),
+                                   columns=seq_features + [f'SHAP {x}' for x in seq_features]))
+
+    return pd.concat(frames, ignore_index=True)
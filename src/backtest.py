@@ -0,0 +1,175 @@
+import joblib
+import numpy as np
+import pandas as pd
+import src.data as data
+import src.evaluation as evaluation
+import src.main as main
+import src.prefixes as prefixes
+
+data_set = "sepsis"
+target_activity = "Admission IC"
+mode = "rf"  # "complete", "static", "sequential", "lr", "rf", "gb", "ada", "knn", "nb"
+max_len = 100
+min_len = 3
+cutoffs = None  # cutoff dates of the windows, e.g. ["2014-06-01", "2014-09-01"]. none: num_windows cutoffs at evenly
+# spaced quantiles of the case start times, the first one after min_train_size of the cases
+num_windows = 5
+min_train_size = 0.5
+train_window = None  # days before the cutoff whose cases are used for training and validation. none: all earlier cases
+val_size = 0.2  # fraction of the cases before the cutoff used for validation, the latest ones
+seed = 0  # window i is seeded with seed + i
+n_jobs = -1  # number of worker processes training windows in parallel (-1: one per core)
+
+
+def get_cutoffs(start_times, num_windows, min_train_size):
+    """
+    :param start_times: time stamps of the first events of the cases (int64 nanoseconds)
+    :param num_windows: number of windows
+    :param min_train_size: fraction of the cases starting before the first cutoff
+    :return: array of cutoffs (int64 nanoseconds), one per window
+    """
+    start_times = np.sort(start_times)
+    quantiles = np.linspace(min_train_size, 1, num_windows + 1)[:-1]
+
+    return start_times[(quantiles * (len(start_times) - 1)).astype(int)]
+
+
+def get_windows(store, cutoffs, val_size, train_window=None):
+    """
+    Splits the prefixes of a prefix store into the training, validation and test prefixes of rolling-origin windows.
+    Like in main.evaluate, training prefixes end before the first validation case starts and validation prefixes
+    end before the cutoff; the test prefixes are all prefixes of the cases starting between the cutoff and the next one.
+    :param store: prefix store of all cases created by prefixes.create_prefix_store with x_time_vals
+    :param cutoffs: cutoffs of the windows (int64 nanoseconds), ascending
+    :param val_size: fraction of the cases before a cutoff used for validation, the latest ones
+    :param train_window: by default none. if set, only cases starting at most train_window days before a cutoff are
+        used for training and validation
+    :return: list of dictionaries, one per window
+        cutoff : cutoff of the window
+        train : rows of the training prefixes in store['index']
+        val : rows of the validation prefixes
+        test : rows of the test prefixes
+    """
+    start_times = store['times'][store['offsets'][:-1]]
+    trace_ids = store['index'][:, 0]
+    end_times = prefixes.get_prefix_end_times(store)  # computed once for all windows
+    ends = np.r_[cutoffs[1:], np.iinfo(np.int64).max]
+
+    windows = []
+    for cutoff, end in zip(cutoffs, ends):
+        earliest = np.iinfo(np.int64).min if train_window is None else cutoff - int(train_window * 24 * 3600 * 1e9)
+        past_cases = np.flatnonzero((start_times >= earliest) & (start_times < cutoff))
+        past_cases = past_cases[np.argsort(start_times[past_cases], kind='stable')]
+        val_cases = past_cases[int((1 - val_size) * len(past_cases)):]
+        val_start = start_times[val_cases[0]] if len(val_cases) else cutoff
+
+        is_train = np.isin(trace_ids, past_cases[:int((1 - val_size) * len(past_cases))])
+        is_val = np.isin(trace_ids, val_cases)
+        is_test = (start_times[trace_ids] >= cutoff) & (start_times[trace_ids] < end)
+
+        windows.append({'cutoff': cutoff,
+                        'train': np.flatnonzero(is_train & (end_times <= val_start)),
+                        'val': np.flatnonzero(is_val & (end_times <= cutoff)),
+                        'test': np.flatnonzero(is_test)})
+
+    return windows
+
+
+def get_window_data(store, tensors, rows):
+    """
+    :param store: prefix store of all cases
+    :param tensors: padded prefixes of the store (see prefixes.get_prefix_batch), none for ragged pipelines
+    :param rows: rows of the prefixes of a split of a window
+    :return: sequential data (prefix store if tensors is none), static data and target attribute of the prefixes
+    """
+    if tensors is None:
+        subset = prefixes.get_prefix_subset(store, rows)
+        return subset, None, subset['y'][subset['index'][:, 0]].astype(np.int32)
+
+    return tensors[0][rows], tensors[1][rows], tensors[2][rows]
+
+
+def run_window(window_seed, mode, window, store, tensors, settings):
+    """
+    Trains the ml model of a window with main.run_repetition and scores its test prefixes.
+    :param window_seed: seed of the window
+    :param mode: determines how the ml model will be trained
+    :param window: window (see get_windows)
+    :param store: prefix store of all cases
+    :param tensors: padded prefixes of the store, none for ragged pipelines
+    :param settings: settings of main (see main.get_settings)
+    :return: dataframe with the metrics per prefix length of the test prefixes (see evaluation.get_prefix_length_metrics)
+        and their auc across all prefix lengths
+    """
+    splits = [get_window_data(store, tensors, window[split]) for split in ['train', 'val', 'test']]
+    _, _, preds, preds_proba = main.run_repetition(window_seed, mode, settings['hps'], settings['hpo'], *splits[0],
+                                                    *splits[1], *splits[2], return_weights=True, settings=settings)
+
+    ts, gts = store['index'][window['test'], 1], splits[2][2]
+    metrics_window = evaluation.get_prefix_length_metrics(ts, gts, preds, preds_proba)
+    metrics_window['auc_window'] = evaluation.get_grouped_auc(np.zeros(len(gts)), gts, np.asarray(preds_proba))[0]
+
+    return metrics_window
+
+
+def run_backtest(x_seqs, x_statics, y, x_time, mode, cutoffs, val_size=0.2, train_window=None, seed=0, n_jobs=1):
+    """
+    Runs a rolling-origin backtest: for every cutoff a model is trained on the cases before it and tested on the cases
+    starting until the next cutoff. The prefixes are created (and padded) once and shared by all windows.
+    :param x_seqs: sequential features of the cases, ordered by their first time stamp (see data.get_sepsis_data)
+    :param x_statics: static features of the cases
+    :param y: target attribute of the cases
+    :param x_time: time stamps of the events of the cases
+    :param mode: determines how the ml model will be trained (see main.evaluate)
+    :param cutoffs: cutoffs of the windows (int64 nanoseconds), ascending
+    :param val_size: fraction of the cases before a cutoff used for validation
+    :param train_window: by default none. if set, only cases starting at most train_window days before a cutoff are
+        used for training and validation
+    :param seed: window i is seeded with seed + i
+    :param n_jobs: number of worker processes training windows in parallel
+    :return: dataframe with one row per window and prefix length
+        window, cutoff, num_train, num_val, num_test : window and its number of prefixes
+        prefix_len, num_prefixes, accuracy, auc : metrics of the test prefixes of a length
+        auc_window : auc of all test prefixes of the window
+    """
+    store = prefixes.create_prefix_store(x_seqs, x_statics, y, main.min_size_prefix, x_time)
+    windows = get_windows(store, np.asarray(cutoffs, dtype=np.int64), val_size, train_window)
+
+    if mode in ["complete", "static", "sequential"]:
+        ragged = main.pipeline in ["streaming", "bucketed", "sparse"]
+    else:
+        ragged = main.matrix_format == "csr"
+    tensors = None if ragged else prefixes.get_prefix_batch(store, slice(None), main.max_len)
+
+    main.mode = mode
+    settings = main.get_settings()
+    metrics_windows = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(run_window)(seed + idx, mode, window, store, tensors, settings)
+        for idx, window in enumerate(windows))
+
+    for idx, (window, metrics_window) in enumerate(zip(windows, metrics_windows)):
+        for position, (name, value) in enumerate([('window', idx), ('cutoff', pd.Timestamp(window['cutoff'])),
+                                                  ('num_train', len(window['train'])),
+                                                  ('num_val', len(window['val'])),
+                                                  ('num_test', len(window['test']))]):
+            metrics_window.insert(position, name, value)
+
+    return pd.concat(metrics_windows, ignore_index=True)
+
+
+if __name__ == '__main__':
+    x_seqs, x_statics, y, x_time, _, _, _ = data.get_sepsis_data(target_activity, max_len, min_len)
+    main.max_len, main.target_activity, main.data_set = max_len, target_activity, data_set
+
+    if cutoffs is None:
+        start_times = np.array([np.datetime64(x[0], 'ns').view('int64') for x in x_time])
+        cutoffs = get_cutoffs(start_times, num_windows, min_train_size)
+    else:
+        cutoffs = [pd.Timestamp(cutoff).value for cutoff in cutoffs]
+
+    results = run_backtest(x_seqs, x_statics, y, x_time, mode, cutoffs, val_size, train_window, seed, n_jobs)
+    results.to_csv(f'../output/{data_set}_{mode}_{target_activity}_backtest.csv', index=False)
+
+    for window, results_window in results.groupby('window'):
+        print(f'window,{window},cutoff,{results_window["cutoff"].iloc[0]},'
+              f'test prefixes,{results_window["num_test"].iloc[0]},auc,{results_window["auc_window"].iloc[0]}')
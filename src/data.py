@@ -1,24 +1,213 @@
+import hashlib
+import os
 import pandas as pd
 import src.util as util
 import numpy as np
 
+cache_version = 2  # bump whenever the encoding, the scalers or the layout of the cached cases change
 
-def get_sepsis_data(target_activity, max_len, min_len):
+
+def fit_sepsis_scalers(df):
     """
-    Creates sequences from the sepsis dataset.
-    :param target_activity:
-    :param max_len: determines the maximal length of the returned lists
-    :param min_len: determines the minimal length of the returned lists
-    :return: six lists.
-        x_seqs_ : one-hot coded sequence list, storing the values of the sequential_features
-        x_statics_ : list of arrays, storing the values of the static_features
-        y_ : numerical list. each entry is either 0 or 1. 0 if target_activity is not in sequence, 1 if target_activity is in sequence
-        x_time_vals_ : list of lists containing timestamps
-        seq_features : list of sequence features
-        static_features : list of static features
+    Computes the column statistics used to normalize the sepsis dataset once.
+    :param df: event log of the sepsis dataset
+    :return: dictionary of normalization constants
+        max_age : maximal value of the age (missing ages count as -1)
+        max_leucocytes : 95th percentile of the leucocytes values (remove outliers)
+        max_lacticacid : 95th percentile of the lacticacid values (remove outliers)
+    """
+    return {'max_age': df['Age'].fillna(-1).max(),
+            'max_leucocytes': np.percentile(df['Leucocytes'].dropna(), 95),
+            'max_lacticacid': np.percentile(df['LacticAcid'].dropna(), 95)}
+
+
+def apply_sepsis_scalers(df, scalers):
+    """
+    Normalizes the static features of the sepsis dataset with previously fitted scalers.
+    The lab values of the sequential features are normalized during encoding (see util.get_one_hot_of_activities_sepsis).
+    :param df: event log of the sepsis dataset
+    :param scalers: dictionary of normalization constants returned by fit_sepsis_scalers
+    :return: normalized event log
+    """
+    df['Age'] = df['Age'].fillna(-1) / scalers['max_age']
+
+    return df
+
+
+def parse_sepsis_log(ds_path, scalers, seq_features, static_features):
+    """
+    Parses the sepsis event log and encodes the complete cases once for all target activities.
+    :param ds_path: path of the event log
+    :param scalers: dictionary of normalization constants. if none, they are fitted on the event log
+    :param seq_features: list of sequence features
+    :param static_features: list of static features
+    :return: two objects:
+        log : dictionary of arrays
+            events : one-hot coded events of all cases starting with 'ER Registration', one row per event
+            offsets : start of each case in events, the last entry is the number of events
+            statics : values of the static_features, one row per case
+            times : timestamps of the events as int64 nanoseconds
+            first_positions : (number of cases x number of seq_features) position of the first occurrence of each
+                activity within its case, the length of the case if the activity does not occur
+        scalers : dictionary of normalization constants
+    """
+    df = pd.read_csv(ds_path)
+    df['Complete Timestamp'] = pd.to_datetime(df['Complete Timestamp'])
+
+    # Sort case id by timestamp of first event
+    df_ = df.groupby('Case ID').first()
+    df_ = df_.sort_values(by='Complete Timestamp')
+    x = pd.CategoricalDtype(df_.index.values, ordered=True)
+    df['Case ID'] = df['Case ID'].astype(x)
+    df = df.sort_values(['Case ID', 'Complete Timestamp'])
+    df = df.reset_index()
+
+    if scalers is None:
+        scalers = fit_sepsis_scalers(df)
+    df = apply_sepsis_scalers(df, scalers)
+
+    # Case boundaries of the sorted log
+    case_codes = df['Case ID'].cat.codes.values
+    starts = np.flatnonzero(np.r_[True, case_codes[1:] != case_codes[:-1]])
+    ends = np.r_[starts[1:], len(df)]
+
+    # Only cases starting with 'ER Registration' are considered
+    activities = df['Activity'].values
+    after_registration = activities[starts] == 'ER Registration'
+    starts, ends = starts[after_registration], ends[after_registration]
+
+    # Row positions of all events, case by case
+    lengths = ends - starts
+    offsets = np.r_[0, np.cumsum(lengths)]
+    rows = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, lengths)
+
+    # Events of a case sharing a timestamp are ordered like in the former loop over the cases, which sorted every case
+    # again by its datetime64 timestamps with the default (unstable) quicksort. the first occurrence of the target
+    # activity and so the cut before it depend on this order (important for data leakage)
+    case_times = np.asarray(df['Complete Timestamp'].values[rows], dtype='datetime64[ns]')
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        rows[start:end] = rows[start:end][np.argsort(case_times[start:end], kind='quicksort')]
+
+    events = util.get_one_hot_of_activities_sepsis(activities[rows], df['Leucocytes'].values[rows],
+                                                   df['CRP'].values[rows], df['LacticAcid'].values[rows],
+                                                   seq_features, scalers['max_leucocytes'],
+                                                   scalers['max_lacticacid'])
+    times = np.asarray(df['Complete Timestamp'].values[rows], dtype='datetime64[ns]').view('int64')
+    statics = df[static_features].iloc[starts].values.astype(float)
+
+    # First occurrence of every activity: the minimal position within the case of its events
+    act_codes = pd.Index(seq_features).get_indexer(activities[rows])
+    case_ids = np.repeat(np.arange(len(starts)), lengths)
+    first_positions = np.repeat(lengths[:, None], len(seq_features), axis=1)
+    np.minimum.at(first_positions, (case_ids, act_codes), np.arange(len(rows)) - offsets[case_ids])
+
+    log = {'events': events, 'offsets': offsets, 'statics': statics, 'times': times,
+           'first_positions': first_positions}
+
+    return log, scalers
+
+
+def cut_sepsis_cases(log, target_activity, max_len, min_len, seq_features):
+    """
+    Creates the encoded cases of a target activity by slicing the parsed event log.
+    :param log: dictionary of arrays returned by parse_sepsis_log
+    :param target_activity: target activity, cases are cut before its first occurrence
+    :param max_len: determines the maximal length of the cases
+    :param min_len: determines the minimal length of the cases
+    :param seq_features: list of sequence features of the parsed event log
+    :return: dictionary of arrays
+        events : one-hot coded events of all cases, one row per event
+        offsets : start of each case in events, the last entry is the number of events
+        statics : values of the static_features, one row per case
+        y : 1 if target_activity is in the case, else 0
+        times : timestamps of the events as int64 nanoseconds
+    """
+    starts = log['offsets'][:-1]
+    case_lengths = np.diff(log['offsets'])
+
+    # Cut each case before the first occurrence of the target activity (important for data leakage)
+    lengths = log['first_positions'][:, seq_features.index(target_activity)]
+    found_target = lengths < case_lengths
+
+    keep = (min_len <= lengths) & (lengths <= max_len)
+    starts, lengths, found_target = starts[keep], lengths[keep], found_target[keep]
+
+    # Event rows of all kept events, case by case
+    offsets = np.r_[0, np.cumsum(lengths)]
+    rows = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, lengths)
+
+    return {'events': log['events'][rows], 'offsets': offsets, 'statics': log['statics'][keep],
+            'y': found_target.astype(int), 'times': log['times'][rows]}
+
+
+def create_sepsis_cases(ds_path, target_activity, max_len, min_len, scalers, seq_features, static_features):
+    """
+    Parses the sepsis event log and creates the encoded cases.
+    :param ds_path: path of the event log
+    :param target_activity: target activity, cases are cut before its first occurrence
+    :param max_len: determines the maximal length of the cases
+    :param min_len: determines the minimal length of the cases
+    :param scalers: dictionary of normalization constants. if none, they are fitted on the event log
+    :param seq_features: list of sequence features
+    :param static_features: list of static features
+    :return: two objects:
+        cases : dictionary of arrays (see cut_sepsis_cases)
+        scalers : dictionary of normalization constants
+    """
+    log, scalers = parse_sepsis_log(ds_path, scalers, seq_features, static_features)
+
+    return cut_sepsis_cases(log, target_activity, max_len, min_len, seq_features), scalers
+
+
+def get_cache_path(ds_path, params):
+    """
+    Returns the path of the cached cases for an event log and its preprocessing parameters.
+    The cache is stored next to the event log and keyed on the hash of the file, the parameters and cache_version.
+    :param ds_path: path of the event log
+    :param params: list of preprocessing parameters
+    :return: path of the cache file
+    """
+    key = hashlib.sha1()
+    with open(ds_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            key.update(chunk)
+    key.update(repr([cache_version] + list(params)).encode())
+
+    return os.path.join(os.path.dirname(ds_path), 'cache', f'{os.path.basename(ds_path)}.{key.hexdigest()}.npz')
+
+
+def save_cases(cache_path, cases, scalers):
+    """
+    Writes the encoded cases and their normalization constants to a columnar cache file.
+    :param cache_path: path of the cache file
+    :param cases: dictionary of arrays returned by create_sepsis_cases
+    :param scalers: dictionary of normalization constants
     """
-    ds_path = '../data/Sepsis Cases - Event Log.csv'
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, scaler_names=np.array(list(scalers.keys())), scaler_values=np.array(list(scalers.values())),
+                 **cases)
+    os.replace(tmp_path, cache_path)  # no half-written cache if the run is interrupted
 
+
+def load_cases(cache_path):
+    """
+    Reads the encoded cases and their normalization constants from a cache file.
+    :param cache_path: path of the cache file
+    :return: dictionary of arrays (see create_sepsis_cases) and dictionary of normalization constants
+    """
+    with np.load(cache_path) as f:
+        cases = {name: f[name] for name in ['events', 'offsets', 'statics', 'y', 'times']}
+        scalers = dict(zip(f['scaler_names'].tolist(), f['scaler_values'].tolist()))
+
+    return cases, scalers
+
+
+def get_sepsis_features():
+    """
+    :return: list of sequence features and list of static features of the sepsis dataset
+    """
     static_features = ['InfectionSuspected', 'DiagnosticBlood', 'DisfuncOrg',
                        'SIRSCritTachypnea', 'Hypotensie',
                        'SIRSCritHeartRate', 'Infusion', 'DiagnosticArtAstrup', 'Age',
@@ -33,70 +222,88 @@ def get_sepsis_data(target_activity, max_len, min_len):
                     'Return ER', 'Release A', 'Release B', 'Release C', 'Release D',
                     'Release E']
 
-    int2act = dict(zip(range(len(seq_features)), seq_features))
+    return seq_features, static_features
 
-    df = pd.read_csv(ds_path)
-    df['Complete Timestamp'] = pd.to_datetime(df['Complete Timestamp'])
 
-    # Sort case id by timestamp of first event
-    df_ = df.groupby('Case ID').first()
-    df_ = df_.sort_values(by='Complete Timestamp')
-    x = pd.CategoricalDtype(df_.index.values, ordered=True)
-    df['Case ID'] = df['Case ID'].astype(x)
-    df = df.sort_values(['Case ID', 'Complete Timestamp'])
-    df = df.reset_index()
+def get_case_lists(cases):
+    """
+    Splits the encoded cases into one list entry per case.
+    :param cases: dictionary of arrays (see cut_sepsis_cases)
+    :return: four lists: sequences, static values, targets and datetime indexes of the cases (see get_sepsis_data)
+    """
+    offsets = cases['offsets']
+    times = pd.DatetimeIndex(cases['times'].view('datetime64[ns]'))
 
-    df['Age'] = df['Age'].fillna(-1)
-    df['Age'] = df['Age'].apply(lambda x: x / max(df['Age']))
+    x_seqs_ = [cases['events'][offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    x_statics_ = list(cases['statics'])
+    y_ = cases['y'].tolist()
+    x_time_vals_ = [times[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
 
-    max_leucocytes = np.percentile(df['Leucocytes'].dropna(), 95)  # remove outliers
-    max_lacticacid = np.percentile(df['LacticAcid'].dropna(), 95)  # remove outliers
+    assert len(x_seqs_) == len(x_statics_) == len(y_) == len(x_time_vals_)
 
-    x_seqs = []
-    x_statics = []
-    x_time_vals = []
-    y = []
+    return x_seqs_, x_statics_, y_, x_time_vals_
 
-    for case in df['Case ID'].unique():
 
-        after_registration_flag = False
-        found_target_flag = False
+def get_sepsis_data_targets(target_activities, max_len, min_len, scalers=None,
+                            ds_path='../data/Sepsis Cases - Event Log.csv', use_cache=True):
+    """
+    Creates sequences from the sepsis dataset for several target activities.
+    The event log is parsed and encoded once, the cases of each target activity are slices of it.
+    :param target_activities: list of target activities
+    :param max_len: determines the maximal length of the returned lists
+    :param min_len: determines the minimal length of the returned lists
+    :param scalers: dictionary of normalization constants (see fit_sepsis_scalers). none by default, then they are fitted on the dataset
+    :param ds_path: path of the event log
+    :param use_cache: if true, the encoded cases are read from / written to a cache next to the event log
+    :return: dictionary of the seven objects returned by get_sepsis_data per target activity
+    """
+    seq_features, static_features = get_sepsis_features()
 
-        df_tmp = df[df['Case ID'] == case]
-        df_tmp = df_tmp.sort_values(by='Complete Timestamp')
+    log = None
+    sepsis_data = {}
+    for target_activity in target_activities:
+        cache_path = None
+        if use_cache:
+            cache_path = get_cache_path(ds_path, [target_activity, max_len, min_len, scalers, seq_features,
+                                                  static_features])
 
-        idx = -1
-        for _, x in df_tmp.iterrows():
-            idx = idx + 1
-            if x['Activity'] == 'ER Registration' and idx == 0:
-                x_statics.append(x[static_features].values.astype(float))
-                x_time_vals.append([])
-                x_seqs.append([])
-                after_registration_flag = True
+        if cache_path is not None and os.path.exists(cache_path):
+            cases, target_scalers = load_cases(cache_path)
+        else:
+            if log is None:
+                log, log_scalers = parse_sepsis_log(ds_path, scalers, seq_features, static_features)
+            cases, target_scalers = cut_sepsis_cases(log, target_activity, max_len, min_len, seq_features), log_scalers
+            if cache_path is not None:
+                save_cases(cache_path, cases, target_scalers)
 
-            if x['Activity'] == target_activity and after_registration_flag:
-                found_target_flag = True
+        sepsis_data[target_activity] = get_case_lists(cases) + (seq_features, static_features, target_scalers)
 
-            if after_registration_flag:
-                if not found_target_flag:  # important for data leakage
-                    x_seqs[-1].append(util.get_one_hot_of_activity_sepsis(x, max_leucocytes, max_lacticacid))
-                    x_time_vals[-1].append(x['Complete Timestamp'])
+    return sepsis_data
 
-        if after_registration_flag:
-            if found_target_flag:
-                y.append(1)
-            else:
-                y.append(0)
 
-    assert len(x_seqs) == len(x_statics) == len(y) == len(x_time_vals)
+def get_sepsis_data(target_activity, max_len, min_len, scalers=None, ds_path='../data/Sepsis Cases - Event Log.csv',
+                    use_cache=True):
+    """
+    Creates sequences from the sepsis dataset.
+    :param target_activity:
+    :param max_len: determines the maximal length of the returned lists
+    :param min_len: determines the minimal length of the returned lists
+    :param scalers: dictionary of normalization constants (see fit_sepsis_scalers). none by default, then they are fitted on the dataset
+    :param ds_path: path of the event log
+    :param use_cache: if true, the encoded cases are read from / written to a cache next to the event log
+    :return: seven objects.
+        x_seqs_ : list of one-hot coded arrays (case length x number of seq_features), storing the values of the sequential_features
+        x_statics_ : list of arrays, storing the values of the static_features
+        y_ : numerical list. each entry is either 0 or 1. 0 if target_activity is not in sequence, 1 if target_activity is in sequence
+        x_time_vals_ : list of datetime indexes containing the timestamps of each case
+        seq_features : list of sequence features
+        static_features : list of static features
+        scalers : dictionary of normalization constants, can be passed again to normalize new cases
+    """
+    x_seqs_, x_statics_, y_, x_time_vals_, seq_features, static_features, scalers = get_sepsis_data_targets(
+        [target_activity], max_len, min_len, scalers, ds_path, use_cache)[target_activity]
 
-    x_seqs_, x_statics_, y_, x_time_vals_ = [], [], [], []
-    for i, x in enumerate(x_seqs):
-        if min_len <= len(x) <= max_len:
-            x_seqs_.append(x)
-            x_statics_.append(x_statics[i])
-            y_.append(y[i])
-            x_time_vals_.append(x_time_vals[i])
+    int2act = dict(zip(range(len(seq_features)), seq_features))
 
     """
     # Create event log
@@ -109,4 +316,4 @@ def get_sepsis_data(target_activity, max_len, min_len):
     f.close()
     """
 
-    return x_seqs_, x_statics_, y_, x_time_vals_, seq_features, static_features
\ No newline at end of file
+    return x_seqs_, x_statics_, y_, x_time_vals_, seq_features, static_features, scalers
\ No newline at end of file
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+
+def get_grouped_auc(groups, gts, preds_proba):
+    """
+    Computes the roc auc of every group in one pass by the rank sum (mann-whitney u) of the positive samples.
+    Tied scores get their average rank, like sklearn.metrics.roc_auc_score.
+    :param groups: group of every sample, sorted
+    :param gts: ground truth (0 or 1) of every sample
+    :param preds_proba: predicted probability of the positive class of every sample
+    :return: array of aucs in the order of the groups, nan for groups with only one class
+    """
+    order = np.lexsort((preds_proba, groups))
+    groups, gts, preds_proba = groups[order], gts[order], preds_proba[order]
+
+    group_starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    tie_starts = np.flatnonzero(np.r_[True, (groups[1:] != groups[:-1]) | (preds_proba[1:] != preds_proba[:-1])])
+    tie_ends = np.r_[tie_starts[1:], len(groups)]
+
+    # average rank of every run of tied scores within its group (ranks start at 1)
+    group_of_tie = np.searchsorted(group_starts, tie_starts, side='right') - 1
+    tie_ranks = (tie_starts + tie_ends - 1) / 2 - group_starts[group_of_tie] + 1
+    ranks = np.repeat(tie_ranks, tie_ends - tie_starts)
+
+    num_pos = np.add.reduceat(gts, group_starts).astype(float)
+    num_neg = np.diff(np.r_[group_starts, len(groups)]) - num_pos
+    rank_sums = np.add.reduceat(ranks * gts, group_starts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aucs = (rank_sums - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg)
+
+    return np.where((num_pos > 0) & (num_neg > 0), aucs, np.nan)
+
+
+def get_prefix_length_metrics(ts, gts, preds, preds_proba):
+    """
+    Computes the accuracy and the roc auc per prefix length.
+    :param ts: prefix length of every prediction
+    :param gts: ground truth (0 or 1) of every prediction
+    :param preds: predicted class of every prediction
+    :param preds_proba: predicted probability of the positive class of every prediction
+    :return: dataframe with one row per prefix length (prefix_len, num_prefixes, accuracy, auc), auc is nan if all
+        prefixes of a length have the same ground truth
+    """
+    ts, gts, preds = np.asarray(ts), np.asarray(gts, dtype=int), np.asarray(preds, dtype=int)
+    preds_proba = np.asarray(preds_proba, dtype=float)
+
+    order = np.argsort(ts, kind='stable')
+    ts, gts, preds, preds_proba = ts[order], gts[order], preds[order], preds_proba[order]
+    prefix_lens, group_starts, num_prefixes = np.unique(ts, return_index=True, return_counts=True)
+
+    return pd.DataFrame({'prefix_len': prefix_lens,
+                         'num_prefixes': num_prefixes,
+                         'accuracy': np.add.reduceat((gts == preds).astype(float), group_starts) / num_prefixes,
+                         'auc': get_grouped_auc(ts, gts, preds_proba)})
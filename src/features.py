@@ -0,0 +1,105 @@
+import weakref
+import numpy as np
+from scipy import sparse
+import src.prefixes as prefixes
+
+max_cached_matrices = 6  # e.g. train, val and test split of the current target activity in two formats
+feature_matrices = {}
+
+
+def concatenate_tensor_matrix(x_seq, x_stat, matrix_format="dense"):
+    """
+    Concatenates two datasets and returns them as a matrix.
+    :param x_seq: dataset of sequential features
+    :param x_stat: dataset of static features
+    :param matrix_format: "dense": float64 array | "float32": float32 array | "csr": float32 scipy csr matrix, only the
+        non-zero entries of the mostly padded time steps are stored
+    :return: concatenated dataset containing static and sequential features
+    """
+    x_seq_ = x_seq.reshape(-1, x_seq.shape[1] * x_seq.shape[2])
+
+    if matrix_format == "csr":
+        return sparse.hstack([sparse.csr_matrix(x_seq_, dtype=np.float32),
+                              sparse.csr_matrix(x_stat, dtype=np.float32)], format='csr')
+    elif matrix_format == "float32":
+        return np.concatenate((x_seq_.astype(np.float32, copy=False), x_stat.astype(np.float32)), axis=1)
+    else:
+        return np.concatenate((x_seq_, x_stat), axis=1)
+
+
+def get_store_feature_matrix(store, max_len):
+    """
+    Creates the sparse feature matrix of a prefix store without padding its prefixes.
+    The columns are the same as of the concatenated padded prefix tensors (see concatenate_tensor_matrix).
+    :param store: prefix store created by create_prefix_store
+    :param max_len: number of time steps of the flattened prefixes
+    :return: float32 scipy csr matrix (number of prefixes x max_len * number of features + number of static features)
+    """
+    num_features = store['events'].shape[1]
+    trace_ids, _, time_step, event_rows = prefixes.get_prefix_positions(store, slice(None))
+
+    # rows of the events of all prefixes, ordered by prefix and time step
+    events = sparse.csr_matrix(store['events'], dtype=np.float32)[event_rows]
+    indices = events.indices + np.repeat(time_step * num_features, np.diff(events.indptr))
+    indptr = events.indptr[np.r_[0, np.cumsum(store['index'][:, 1])]]
+    x_seq_ = sparse.csr_matrix((events.data, indices, indptr), shape=(len(trace_ids), max_len * num_features))
+
+    return sparse.hstack([x_seq_, sparse.csr_matrix(store['statics'][trace_ids], dtype=np.float32)], format='csr')
+
+
+def concatenate_rows(x_a, x_b):
+    """
+    Stacks two feature matrices of the same format.
+    :param x_a: first feature matrix
+    :param x_b: second feature matrix
+    :return: rows of x_a followed by rows of x_b
+    """
+    if sparse.issparse(x_a):
+        return sparse.vstack([x_a, x_b], format='csr')
+    else:
+        return np.concatenate((x_a, x_b), axis=0)
+
+
+def get_source_key(x):
+    """
+    :param x: array
+    :return: key of the array object by its id, shape and type. the values are not read
+    """
+    return id(x), x.shape, x.dtype.str
+
+
+def get_feature_matrix(x_seq, x_stat, matrix_format="dense", max_len=None):
+    """
+    Returns the feature matrix of two datasets (see concatenate_tensor_matrix) or of a prefix store.
+    The matrix is created once per datasets and format and reused by all models and hps candidates trained on them.
+    The datasets are identified by their array objects, not by hashing their values, so the lookup is cheap; the cached
+    matrix keeps weak references to them and is not reused for a new array that got the id of a freed one.
+    :param x_seq: dataset of sequential features or prefix store (see prefixes.create_prefix_store)
+    :param x_stat: dataset of static features. not used for a prefix store
+    :param matrix_format: "dense", "float32" or "csr" (see concatenate_tensor_matrix)
+    :param max_len: number of time steps of the flattened prefixes of a prefix store
+    :return: concatenated dataset containing static and sequential features
+    """
+    if isinstance(x_seq, dict):
+        sources = [x_seq[name] for name in ['events', 'offsets', 'statics', 'index']]
+        key = tuple(get_source_key(x) for x in sources) + (max_len, matrix_format)
+    else:
+        sources = [x_seq, x_stat]
+        key = tuple(get_source_key(x) for x in sources) + (matrix_format,)
+
+    if key in feature_matrices and any(ref() is not x for ref, x in zip(feature_matrices[key][0], sources)):
+        del feature_matrices[key]  # id of a freed array
+
+    if key not in feature_matrices:
+        if len(feature_matrices) >= max_cached_matrices:
+            del feature_matrices[next(iter(feature_matrices))]  # oldest matrix
+
+        if isinstance(x_seq, dict):
+            feature_matrix = get_store_feature_matrix(x_seq, max_len)
+            if matrix_format != "csr":
+                feature_matrix = feature_matrix.toarray().astype(np.float32 if matrix_format == "float32" else np.float64)
+        else:
+            feature_matrix = concatenate_tensor_matrix(x_seq, x_stat, matrix_format)
+        feature_matrices[key] = ([weakref.ref(x) for x in sources], feature_matrix)
+
+    return feature_matrices[key][1]
@@ -0,0 +1,202 @@
+import copy
+import functools
+import itertools
+import joblib
+import numpy as np
+from sklearn import base, ensemble, metrics, model_selection
+
+
+def grid_search(fit_score, candidates, n_jobs=1, grid_order=None):
+    """
+    Evaluates all hyperparameter candidates of a grid and selects the best one by its validation auc.
+    With n_jobs != 1 the candidates are trained in parallel worker processes.
+    :param fit_score: function fit_score(spec) returning the trained model and its validation auc. must be picklable
+        (a module level function or a functools.partial of it), if n_jobs != 1
+    :param candidates: list of (hps, spec) tuples in grid order. hps are returned for the best candidate, spec is passed
+        to fit_score. if hps is a list of hps, the candidates are trained together and fit_score returns a list of
+        (model, auc) tuples, one per hps (see fit_score_ensemble)
+    :param n_jobs: number of worker processes. 1: no worker processes | -1: one worker process per core
+    :param grid_order: by default none. list of all hps in grid order, needed if candidates are trained together and
+        their grouping differs from the grid order. the results are put into this order before the best one is selected
+    :return: three objects:
+        best_model : model of the best candidate. for equal aucs the later candidate wins
+        best_hps : hps of the best candidate
+        aucs : list of validation aucs in grid order
+    """
+    if n_jobs == 1:
+        results = (fit_score(spec) for _, spec in candidates)
+    else:
+        results = joblib.Parallel(n_jobs=n_jobs)(joblib.delayed(fit_score)(spec) for _, spec in candidates)
+
+    results = [(hps, model_auc) for (hps_candidate, _), result in zip(candidates, results)
+               for hps, model_auc in (zip(hps_candidate, result) if isinstance(hps_candidate, list)
+                                      else [(hps_candidate, result)])]
+    if grid_order is not None:
+        results.sort(key=lambda result: grid_order.index(result[0]))
+
+    best_model = ""
+    best_hps = ""
+    aucs = []
+
+    for hps, (model, auc) in results:
+        aucs.append(auc)
+
+        if auc >= max(aucs):
+            best_model = model
+            best_hps = hps
+
+    return best_model, best_hps, aucs
+
+
+def successive_halving(fit_score, candidates, min_budget=1 / 9, eta=3, n_jobs=1):
+    """
+    Evaluates the hyperparameter candidates of a grid in stages of increasing budget (successive halving).
+    All candidates are trained with min_budget, only the best 1 / eta of them are trained again with eta times the budget,
+    until the remaining candidates are trained with the full budget.
+    :param fit_score: function fit_score(spec, budget) returning the trained model and its validation auc. the budget is
+        the fraction of the training data the model is trained on (see get_subsample)
+    :param candidates: list of (hps, spec) tuples in grid order (see grid_search)
+    :param min_budget: budget of the first stage
+    :param eta: factor by which the budget grows and the number of candidates shrinks from stage to stage
+    :param n_jobs: number of worker processes (see grid_search)
+    :return: three objects:
+        best_model : model of the best candidate of the last stage
+        best_hps : hps of the best candidate of the last stage
+        stages : list of dictionaries (budget, hps, aucs), one per stage, aucs in grid order
+    """
+    num_stages = int(np.ceil(np.log(1 / min_budget) / np.log(eta) - 1e-9)) + 1
+    budgets = [min(min_budget * eta ** stage, 1.) for stage in range(num_stages)]
+
+    stages = []
+    for budget in budgets:
+        best_model, best_hps, aucs = grid_search(functools.partial(fit_score, budget=budget), candidates, n_jobs)
+        stages.append({'budget': budget, 'hps': [hps for hps, _ in candidates], 'aucs': aucs})
+
+        num_candidates = int(np.ceil(len(candidates) / eta))
+        best_candidates = np.argsort(-np.asarray(aucs), kind='stable')[:num_candidates]
+        candidates = [candidates[idx] for idx in sorted(best_candidates)]
+
+    return best_model, best_hps, stages
+
+
+def get_subsample(y, budget, random_state=0):
+    """
+    Draws a stratified subsample of a training dataset.
+    :param y: target attribute of the training dataset
+    :param budget: fraction of the training dataset to keep
+    :param random_state: seed of the subsample, the same budget always yields the same subsample
+    :return: sorted row indices of the subsample
+    """
+    if budget >= 1:
+        return np.arange(len(y))
+
+    rows, _ = model_selection.train_test_split(np.arange(len(y)), train_size=budget, stratify=np.ravel(y),
+                                               random_state=random_state)
+
+    return np.sort(rows)
+
+
+def get_training_subset(x_train, y_train, budget):
+    """
+    :param x_train: training dataset (feature matrix)
+    :param y_train: training dataset (target attribute)
+    :param budget: fraction of the training dataset to keep (see get_subsample)
+    :return: feature matrix and target attribute of the subsample. with the full budget the training dataset itself,
+        not a copy of it
+    """
+    if budget >= 1:
+        return x_train, np.ravel(y_train)
+
+    rows = get_subsample(y_train, budget)
+
+    return x_train[rows], np.ravel(y_train)[rows]
+
+
+def fit_score_sklearn(model, x_train, y_train, x_val, y_val, budget=1.):
+    """
+    Trains a sklearn model and scores it on the validation data.
+    :param model: untrained sklearn classifier
+    :param x_train: training dataset (feature matrix)
+    :param y_train: training dataset (target attribute)
+    :param x_val: validation dataset (feature matrix)
+    :param y_val: validation dataset (target attribute)
+    :param budget: fraction of the training dataset the model is trained on
+    :return: trained model and validation auc
+    """
+    x_fit, y_fit = get_training_subset(x_train, y_train, budget)
+    model = base.clone(model)
+    model.fit(x_fit, y_fit)
+    preds_proba = model.predict_proba(x_val)[:, 1]
+    auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
+
+    return model, auc
+
+
+def fit_score_ensemble(model, n_estimators, x_train, y_train, x_val, y_val, budget=1.):
+    """
+    Trains a tree ensemble once with the largest number of estimators and scores it for every number of estimators.
+    The smaller ensembles are the first estimators of the largest one, so their training comes for free.
+    :param model: untrained RandomForestClassifier, GradientBoostingClassifier or AdaBoostClassifier
+    :param n_estimators: list of numbers of estimators
+    :param x_train: training dataset (feature matrix)
+    :param y_train: training dataset (target attribute)
+    :param x_val: validation dataset (feature matrix)
+    :param y_val: validation dataset (target attribute)
+    :param budget: fraction of the training dataset the model is trained on
+    :return: list of (trained model, validation auc) tuples, one per entry of n_estimators
+    """
+    x_fit, y_fit = get_training_subset(x_train, y_train, budget)
+    model = base.clone(model).set_params(n_estimators=max(n_estimators))
+    model.fit(x_fit, y_fit)
+
+    results = []
+    for num_estimators, preds_proba in zip(n_estimators, get_staged_predict_proba(model, x_val, n_estimators)):
+        auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
+        results.append((truncate_ensemble(model, num_estimators), auc))
+
+    return results
+
+
+def get_staged_predict_proba(model, x, n_estimators):
+    """
+    Predicts with the first estimators of a trained tree ensemble.
+    Random forests average the probabilities of their trees, boosting models are evaluated by staged predictions.
+    :param model: trained RandomForestClassifier, GradientBoostingClassifier or AdaBoostClassifier
+    :param x: feature matrix
+    :param n_estimators: list of numbers of estimators
+    :return: list of predicted probabilities of the positive class, one per entry of n_estimators
+    """
+    if isinstance(model, ensemble.RandomForestClassifier):
+        sums_proba = itertools.accumulate(tree.predict_proba(x)[:, 1] for tree in model.estimators_)
+        staged_proba = (sum_proba / stage for stage, sum_proba in enumerate(sums_proba, 1))
+    else:
+        staged_proba = (preds_proba[:, 1] for preds_proba in model.staged_predict_proba(x))
+
+    preds_proba = {}
+    for stage, stage_proba in enumerate(staged_proba, 1):
+        if stage in n_estimators:
+            preds_proba[stage] = stage_proba
+
+    # adaboost stops early if it fits the training data perfectly
+    return [preds_proba.get(num_estimators, stage_proba) for num_estimators in n_estimators]
+
+
+def truncate_ensemble(model, n_estimators):
+    """
+    Returns a copy of a trained tree ensemble restricted to its first estimators. The estimators are shared, not copied.
+    :param model: trained RandomForestClassifier, GradientBoostingClassifier or AdaBoostClassifier
+    :param n_estimators: number of estimators to keep
+    :return: trained model with n_estimators estimators
+    """
+    truncated_model = copy.copy(model)
+    truncated_model.n_estimators = n_estimators
+    truncated_model.estimators_ = model.estimators_[:n_estimators]
+
+    if isinstance(model, ensemble.AdaBoostClassifier):
+        truncated_model.estimator_weights_ = model.estimator_weights_[:n_estimators]
+        truncated_model.estimator_errors_ = model.estimator_errors_[:n_estimators]
+    elif isinstance(model, ensemble.GradientBoostingClassifier):
+        truncated_model.train_score_ = model.train_score_[:n_estimators]
+        truncated_model.n_estimators_ = len(truncated_model.estimators_)
+
+    return truncated_model
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def sigmoid(x):
+    """Logistic sigmoid of the logits x, elementwise."""
+    return 1 / (1 + np.exp(-x))
+
+
+def lstm_step(x, h, c, kernel, recurrent_kernel, bias):
+    """
+    Advances the state of a keras lstm layer (gates i, f, c, o; tanh and sigmoid activations) by one time step.
+    :param x: input of the time step (number of features), or a batch of inputs (batch size x number of features)
+    :param h: hidden state
+    :param c: cell state
+    :param kernel: input weights (number of features x 4 * units)
+    :param recurrent_kernel: recurrent weights (units x 4 * units)
+    :param bias: bias (4 * units)
+    :return: hidden state and cell state after the time step
+    """
+    z = x @ kernel + h @ recurrent_kernel + bias
+    i, f, c_, o = np.split(z, 4, axis=-1)
+    c = sigmoid(f) * c + sigmoid(i) * np.tanh(c_)
+
+    return sigmoid(o) * np.tanh(c), c
+
+
+def run_lstm(x_seq, weights, masking=False, go_backwards=False):
+    """
+    Runs a keras lstm layer over a batch of sequences.
+    :param x_seq: sequences (batch size x time steps x number of features)
+    :param weights: kernel, recurrent kernel and bias of the layer
+    :param masking: if true, all-zero time steps leave the state unchanged (see lstm.build_model)
+    :param go_backwards: if true, the sequences are read from their last time step on
+    :return: last hidden state (batch size x units)
+    """
+    units = weights[1].shape[0]
+    h, c = np.zeros((len(x_seq), units)), np.zeros((len(x_seq), units))
+
+    time_steps = range(x_seq.shape[1] - 1, -1, -1) if go_backwards else range(x_seq.shape[1])
+    for t in time_steps:
+        h_, c_ = lstm_step(x_seq[:, t], h, c, *weights)
+        if masking:
+            mask = x_seq[:, t].any(axis=1, keepdims=True)
+            h_, c_ = np.where(mask, h_, h), np.where(mask, c_, c)
+        h, c = h_, c_
+
+    return h
+
+
+def get_static_attributions(weights, x_stat, baseline):
+    """
+    Computes the exact shap values of the static features of a model of mode "complete" or "static" in closed form.
+    The static features enter the logit of the output layer linearly, so the value of a feature is its weight times
+    its difference to the baseline.
+    :param weights: weights of the model (model.get_weights())
+    :param x_stat: static dataset
+    :param baseline: values of the static features the prefixes are compared to, e.g. the mean of the training data
+    :return: shap values in logit space (prefixes x static features)
+    """
+    x_stat = np.asarray(x_stat, dtype=np.float64)
+
+    return (x_stat - np.asarray(baseline, dtype=np.float64)) * np.asarray(weights[-2])[-x_stat.shape[1]:, 0]
+
+
+def predict_lstm(weights, x_seq, x_stat, mode="complete", masking=False):
+    """
+    Predicts with the weights of a model built by lstm.build_model, without tensorflow.
+    :param weights: weights of the model (model.get_weights())
+    :param x_seq: one-hot sequential dataset (prefixes x time steps x features). not used for mode = "static"
+    :param x_stat: static dataset. not used for mode = "sequential"
+    :param mode: architecture of the model
+    :param masking: if true, the model was built with masking
+    :return: predicted probabilities of the positive class
+    """
+    weights = [np.asarray(w, dtype=np.float64) for w in weights]
+    outputs = []
+
+    if mode in ["complete", "sequential"]:
+        outputs.append(run_lstm(x_seq, weights[0:3], masking))
+        outputs.append(run_lstm(x_seq, weights[3:6], masking, go_backwards=True))
+    if mode in ["complete", "static"]:
+        outputs.append(np.asarray(x_stat, dtype=np.float64))
+
+    return sigmoid(np.concatenate(outputs, axis=1) @ weights[-2][:, 0] + weights[-1][0])
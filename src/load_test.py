@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import src.artifacts as artifacts
+import src.data as data
+import src.serving as serving
+
+ds_path = '../data/Sepsis Cases - Event Log.csv'
+artifact_root = '../model/artifacts'  # best lstm model of main.evaluate (see main.save_artifacts)
+target_activity = "Admission IC"
+artifact_name = f'sepsis_complete_{target_activity}'
+artifact_version = None  # none: latest version
+max_len = 100
+min_len = 3
+num_clients = 32
+num_requests = 2000
+batch_sizes = [1, 8, 64]  # maximal micro-batch sizes to compare, 1: every request is predicted on its own
+
+
+def get_sepsis_pathways(ds_path, target_activity, max_len, min_len):
+    """
+    Reads the raw partial patient pathways of the sepsis event log: every prefix of every case before the target
+    activity.
+    :param ds_path: path of the event log
+    :param target_activity: target activity, cases are cut before its first occurrence
+    :param max_len: maximal length of the cases
+    :param min_len: minimal length of the cases
+    :return: list of partial patient pathways (see serving.PredictionService.submit)
+    """
+    seq_features, static_features = data.get_sepsis_features()
+
+    df = pd.read_csv(ds_path)
+    df['Complete Timestamp'] = pd.to_datetime(df['Complete Timestamp'])
+    # Cases ordered by the timestamp of their first event (see data.parse_sepsis_log)
+    df['Case Start'] = df.groupby('Case ID')['Complete Timestamp'].transform('min')
+    df = df.sort_values(['Case Start', 'Case ID', 'Complete Timestamp'], kind='stable')
+
+    pathways = []
+    for _, df_case in df.groupby('Case ID', sort=False):
+        activities = df_case['Activity'].tolist()
+        if activities[0] != 'ER Registration':
+            continue
+        case_len = activities.index(target_activity) if target_activity in activities else len(activities)
+        if not min_len <= case_len <= max_len:
+            continue
+
+        statics = df_case[static_features].iloc[0].to_dict()
+        for prefix_len in range(1, case_len + 1):
+            pathways.append({'activities': activities[:prefix_len],
+                             'leucocytes': df_case['Leucocytes'].values[:prefix_len],
+                             'crp': df_case['CRP'].values[:prefix_len],
+                             'lacticacid': df_case['LacticAcid'].values[:prefix_len],
+                             'statics': statics})
+
+    return pathways
+
+
+if __name__ == '__main__':
+    artifact = artifacts.load_model_artifact(artifact_root, artifact_name, artifact_version)
+    model = artifacts.get_keras_model(artifact)
+    pathways = get_sepsis_pathways(ds_path, target_activity, max_len, min_len)
+    np.random.RandomState(0).shuffle(pathways)
+
+    for max_batch_size in batch_sizes:
+        service = serving.PredictionService(model, artifact['seq_features'], artifact['static_features'],
+                                            artifact['scalers'], artifact['max_len'], artifact['mode'],
+                                            max_batch_size=max_batch_size)
+        service.predict(pathways[0])  # warm-up
+        results = serving.run_load_test(service, pathways, num_clients, num_requests)
+        service.close()
+
+        print(f'max_batch_size,{max_batch_size},p50 (ms),{results["p50"]:.2f},p99 (ms),{results["p99"]:.2f},'
+              f'throughput (requests/s),{results["throughput"]:.1f}')
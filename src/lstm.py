@@ -0,0 +1,376 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import tensorflow as tf
+tf.compat.v1.disable_v2_behavior()
+from sklearn import metrics
+import src.prefixes as prefixes
+import src.hpo as hpo
+
+
+class PrefixSequence(tf.keras.utils.Sequence):
+    """
+    Streams zero-padded batches of prefixes from a prefix store (see prefixes.create_prefix_store).
+    Only the prefixes of the current batch are padded, the blown-up tensor is never materialized.
+    Keras prefetches the next batches in background workers while the current batch is trained.
+    """
+
+    def __init__(self, store, max_len, batch_size, mode="complete", shuffle=False, bucket_boundaries=None):
+        """
+        :param store: prefix store
+        :param max_len: length of the second dimension of the sequential batches
+        :param batch_size: number of prefixes per batch
+        :param mode: architecture of the model, determines the inputs of a batch (see get_inputs)
+        :param shuffle: if true, the prefixes and batches are shuffled before every epoch
+        :param bucket_boundaries: by default none. if set, the prefixes are grouped into buckets of the lengths
+            (bucket_boundaries[i - 1], bucket_boundaries[i]]. a batch only contains prefixes of one bucket and is only
+            padded to its longest prefix instead of max_len
+        """
+        self.store = store
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.mode = mode
+        self.shuffle = shuffle
+        self.bucket_boundaries = bucket_boundaries
+        self.on_epoch_end()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        rows = self.batches[idx]
+        if self.bucket_boundaries is not None:
+            max_len = self.store['index'][rows, 1].max()
+        else:
+            max_len = self.max_len
+        x_seq, x_stat, y = prefixes.get_prefix_batch(self.store, rows, max_len)
+
+        return get_inputs(x_seq, x_stat, self.mode), y.reshape(-1, 1)
+
+    def on_epoch_end(self):
+        rows = np.arange(len(self.store['index']))
+        if self.shuffle:
+            np.random.shuffle(rows)
+
+        if self.bucket_boundaries is not None:
+            bucket_ids = np.digitize(self.store['index'][rows, 1], self.bucket_boundaries, right=True)
+            buckets = [rows[bucket_ids == bucket_id] for bucket_id in np.unique(bucket_ids)]
+        else:
+            buckets = [rows]
+
+        self.batches = [bucket[i:i + self.batch_size] for bucket in buckets
+                        for i in range(0, len(bucket), self.batch_size)]
+        if self.shuffle:
+            self.batches = [self.batches[i] for i in np.random.permutation(len(self.batches))]
+
+    def get_rows(self):
+        """
+        :return: prefixes of the prefix store in the order of the batches
+        """
+        return np.concatenate(self.batches)
+
+    def get_targets(self):
+        """
+        :return: target attribute of the prefixes in the order of the prefix store
+        """
+        return self.store['y'][self.store['index'][:, 0]]
+
+
+def set_seed(seed):
+    """
+    Seeds the graph-level random number generator of tensorflow, the weights of models built afterwards are
+    initialized reproducibly.
+    :param seed: seed
+    """
+    tf.compat.v1.set_random_seed(seed)
+
+
+def get_inputs(x_seq, x_stat, mode):
+    """
+    Returns the inputs of the model of an architecture.
+    :param x_seq: sequential dataset or list of sequential datasets (index and value encoding, see build_model)
+    :param x_stat: static dataset
+    :param mode: "complete" (sequential and static), "static" or "sequential"
+    :return: list of inputs
+    """
+    x_seqs = x_seq if isinstance(x_seq, list) else [x_seq]
+
+    if mode == "complete":
+        return x_seqs + [x_stat]
+    elif mode == "static":
+        return [x_stat]
+    else:
+        return x_seqs
+
+
+def create_feed(x_seq, x_stat, y, mode, batch_size, max_len, shuffle=False, bucket_boundaries=None,
+                sparse_input=False):
+    """
+    Creates the data passed to model.fit / model.predict.
+    :param x_seq: sequential dataset (prefixes x time steps x features) or prefix store (see prefixes.create_prefix_store)
+    :param x_stat: static dataset. not used for a prefix store
+    :param y: target attribute
+    :param mode: architecture of the model (see get_inputs)
+    :param batch_size: number of prefixes per batch
+    :param max_len: length of the second dimension of streamed batches
+    :param shuffle: if true, the prefixes of a prefix store are shuffled before every epoch
+    :param bucket_boundaries: by default none. if set, the prefixes of a prefix store are batched by length
+        (see PrefixSequence)
+    :param sparse_input: if true, the prefixes of a prefix store are index-value encoded at once
+        (see prefixes.get_index_value_batch)
+    :return: tuple of inputs (list of arrays or PrefixSequence) and target attribute (none for a PrefixSequence)
+    """
+    if isinstance(x_seq, dict) and sparse_input:
+        x_index, x_value, x_stat, y = prefixes.get_index_value_batch(x_seq, slice(None), max_len)
+        return get_inputs([x_index, x_value], x_stat, mode), y.reshape(-1, 1)
+    elif isinstance(x_seq, dict):
+        return PrefixSequence(x_seq, max_len, batch_size, mode, shuffle, bucket_boundaries), None
+    else:
+        return get_inputs(x_seq, x_stat, mode), y
+
+
+def get_targets(feed):
+    """
+    :param feed: data created by create_feed
+    :return: target attribute in the order of the predictions (see predict)
+    """
+    if isinstance(feed[0], PrefixSequence):
+        return feed[0].get_targets()
+    else:
+        return feed[1]
+
+
+def get_input_shape(x_seq, x_stat, max_len):
+    """
+    :param x_seq: sequential dataset or prefix store (see prefixes.create_prefix_store)
+    :param x_stat: static dataset. not used for a prefix store
+    :param max_len: number of time steps of streamed prefixes
+    :return: number of time steps, number of sequential features and number of static features
+    """
+    if isinstance(x_seq, dict):
+        return max_len, x_seq['events'].shape[1], x_seq['statics'].shape[1]
+    else:
+        return x_seq.shape[1], x_seq.shape[2], x_stat.shape[1]
+
+
+def build_model(mode, size, learning_rate, max_case_len, num_features_seq, num_features_stat, masking=False,
+                sparse_input=False):
+    """
+    Builds and compiles the model of an architecture.
+    :param mode: "complete": bidirectional lstm on the sequential features, its output and the static features are
+        combined by a sigmoid output layer | "static": logistic regression on the static features |
+        "sequential": bidirectional lstm on the sequential features
+    :param size: number of lstm units per direction. not used for mode = "static"
+    :param learning_rate: learning rate of the adam optimizer
+    :param max_case_len: number of time steps of the sequential input
+    :param num_features_seq: number of sequential features
+    :param num_features_stat: number of static features
+    :param masking: if true, the sequential input has a variable number of time steps and all-zero (padded) time steps
+        are skipped by both directions of the lstm
+    :param sparse_input: if true, the sequential input is index-value encoded (see prefixes.get_index_value_batch) and
+        one-hot decoded by the model, the weights equal those of the model without sparse input
+    :return: compiled model
+    """
+    inputs, outputs = [], []
+
+    if mode in ["complete", "sequential"]:
+        if sparse_input:
+            input_layer_index = tf.keras.layers.Input(shape=(max_case_len,), dtype='int8', name='seq_index_input_layer')
+            input_layer_value = tf.keras.layers.Input(shape=(max_case_len,), name='seq_value_input_layer')
+            input_layer_seq = [input_layer_index, input_layer_value]
+            masking_layer = tf.keras.layers.Lambda(
+                lambda x: tf.one_hot(tf.cast(x[0], tf.int32), num_features_seq) * tf.expand_dims(x[1], -1),
+                name='seq_decoding_layer')(input_layer_seq)
+        elif masking:
+            input_layer_seq = tf.keras.layers.Input(shape=(None, num_features_seq), name='seq_input_layer')
+            # every event has a non-zero entry (missing lab values are coded as -1), only padding is all-zero
+            masking_layer = tf.keras.layers.Masking(mask_value=0.)(input_layer_seq)
+        else:
+            input_layer_seq = tf.keras.layers.Input(shape=(max_case_len, num_features_seq), name='seq_input_layer')
+            masking_layer = input_layer_seq
+        hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(
+            units=size,
+            return_sequences=False))(masking_layer)
+        inputs.extend(input_layer_seq if sparse_input else [input_layer_seq])
+        outputs.append(hidden_layer)
+
+    if mode in ["complete", "static"]:
+        input_layer_static = tf.keras.layers.Input(shape=(num_features_stat), name='static_input_layer')
+        inputs.append(input_layer_static)
+        outputs.append(input_layer_static)
+
+    if len(outputs) > 1:
+        concatenate_layer = tf.keras.layers.Concatenate(axis=1)(outputs)
+    else:
+        concatenate_layer = outputs[0]
+
+    output_layer = tf.keras.layers.Dense(1,
+                                         activation='sigmoid',
+                                         name='output_layer')(concatenate_layer)
+
+    model = tf.keras.models.Model(inputs=inputs, outputs=[output_layer])
+
+    opt = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+    model.compile(loss='binary_crossentropy',
+                  optimizer=opt,
+                  metrics=['accuracy'])
+
+    return model
+
+
+def get_dense_model(model, mode, hps, max_case_len, num_features_seq, num_features_stat):
+    """
+    Converts a model with index-value encoded sequential input into a model with one-hot sequential input.
+    :param model: trained model built with sparse_input (see build_model)
+    :param mode: architecture of the model
+    :param hps: hyperparameters of the model (size, learning_rate)
+    :param max_case_len: number of time steps of the sequential input
+    :param num_features_seq: number of sequential features
+    :param num_features_stat: number of static features
+    :return: model with the weights of model
+    """
+    dense_model = build_model(mode, hps.get("size"), hps["learning_rate"], max_case_len, num_features_seq,
+                              num_features_stat)
+    dense_model.set_weights(model.get_weights())
+
+    return dense_model
+
+
+def get_sequential_logit_model(model):
+    """
+    Extracts the sequential branch of a model of mode "complete": the bidirectional lstm and the part of the output
+    layer weighting its output, without bias and sigmoid. Its output is the contribution of the sequential input to the
+    logit of the prediction, the static features add to the logit linearly.
+    :param model: trained model with one-hot sequential input
+    :return: model with the sequential input of model, sharing its lstm layer
+    """
+    lstm_layer = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Bidirectional)][0]
+    kernel = model.get_layer(name='output_layer').get_weights()[0][:2 * lstm_layer.forward_layer.units]
+
+    logit_layer = tf.keras.layers.Dense(1, use_bias=False, name='seq_logit_layer')
+    seq_logit_model = tf.keras.models.Model(inputs=model.inputs[0], outputs=logit_layer(lstm_layer.output))
+    logit_layer.set_weights([kernel])
+
+    return seq_logit_model
+
+
+def fit_model(model, train_feed, val_feed, batch_size, epochs=100, workers=1, max_queue_size=10,
+              checkpoint_root='../model'):
+    """
+    Trains a model with early stopping and learning rate reduction on the validation loss.
+    :param model: compiled model
+    :param train_feed: training data created by create_feed
+    :param val_feed: validation data created by create_feed
+    :param batch_size: number of prefixes per batch. for a PrefixSequence the batch size of the sequence is used
+    :param epochs: maximal number of epochs
+    :param workers: number of threads creating streamed batches
+    :param max_queue_size: number of streamed batches prepared in advance
+    :param checkpoint_root: directory of the checkpoint of the model with the lowest validation loss. every call writes
+        it to a temporary directory of its own (candidates and repetitions run in parallel), which is removed after
+        training. the returned model keeps the weights of the last epoch
+    :return: trained model
+    """
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
+    os.makedirs(checkpoint_root, exist_ok=True)
+    checkpoint_dir = tempfile.mkdtemp(dir=checkpoint_root)
+    model_checkpoint = tf.keras.callbacks.ModelCheckpoint(os.path.join(checkpoint_dir, 'model.ckpt'),
+                                                          monitor='val_loss',
+                                                          verbose=0,
+                                                          save_best_only=True,
+                                                          save_weights_only=False,
+                                                          mode='auto')
+
+    lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
+                                                      factor=0.5,
+                                                      patience=10,
+                                                      verbose=0,
+                                                      mode='auto',
+                                                      min_delta=0.0001,
+                                                      cooldown=0,
+                                                      min_lr=0)
+
+    model.summary()
+    try:
+        if isinstance(train_feed[0], PrefixSequence):
+            model.fit(train_feed[0],
+                      validation_data=val_feed[0],
+                      verbose=1,
+                      callbacks=[early_stopping, model_checkpoint, lr_reducer],
+                      epochs=epochs,
+                      shuffle=False,  # the sequence shuffles the prefixes itself
+                      workers=workers,
+                      max_queue_size=max_queue_size)
+        else:
+            model.fit(train_feed[0], train_feed[1],
+                      validation_data=val_feed,
+                      verbose=1,
+                      callbacks=[early_stopping, model_checkpoint, lr_reducer],
+                      batch_size=batch_size,
+                      epochs=epochs)
+    finally:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    return model
+
+
+def predict(model, feed):
+    """
+    :param model: trained model
+    :param feed: data created by create_feed
+    :return: predicted probabilities of the positive class. for a PrefixSequence in the order of the prefix store
+    """
+    preds_proba = model.predict(feed[0])[:, 0]
+
+    if isinstance(feed[0], PrefixSequence):
+        preds_proba[feed[0].get_rows()] = preds_proba.copy()
+
+    return preds_proba
+
+
+def fit_score(hps, mode, x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, max_len,
+              bucket_boundaries=None, sparse_input=False, return_weights=False, budget=1.):
+    """
+    Trains the model of an architecture with one hps candidate and scores it on the validation data.
+    :param hps: hyperparameters (size, learning_rate, batch_size)
+    :param mode: architecture of the model (see build_model)
+    :param x_train_seq: training dataset (sequential features) or prefix store
+    :param x_train_stat: training dataset (static features)
+    :param y_train: training dataset (target attribute)
+    :param x_val_seq: validation dataset (sequential features) or prefix store
+    :param x_val_stat: validation dataset (static features)
+    :param y_val: validation dataset (target attribute)
+    :param max_len: number of time steps of streamed prefixes
+    :param bucket_boundaries: by default none. if set, prefix stores are batched by length and padding is masked
+    :param sparse_input: if true, prefix stores are index-value encoded (see build_model)
+    :param return_weights: if true, the weights of the model are returned instead of the model (trained in a worker
+        process, a model cannot be passed back)
+    :param budget: fraction of the training prefixes the model is trained on (see hpo.get_subsample)
+    :return: trained model or its weights and validation auc
+    """
+    if budget < 1:
+        if isinstance(x_train_seq, dict):
+            rows = hpo.get_subsample(x_train_seq['y'][x_train_seq['index'][:, 0]], budget)
+            x_train_seq = prefixes.get_prefix_subset(x_train_seq, rows)
+        else:
+            rows = hpo.get_subsample(y_train, budget)
+            x_train_seq, x_train_stat, y_train = x_train_seq[rows], x_train_stat[rows], y_train[rows]
+
+    masking = bucket_boundaries is not None and isinstance(x_train_seq, dict)
+    sparse_input = sparse_input and isinstance(x_train_seq, dict)
+    max_case_len, num_features_seq, num_features_stat = get_input_shape(x_train_seq, x_train_stat, max_len)
+
+    model = build_model(mode, hps.get("size"), hps["learning_rate"], max_case_len, num_features_seq,
+                        num_features_stat, masking=masking, sparse_input=sparse_input)
+    train_feed = create_feed(x_train_seq, x_train_stat, y_train, mode, hps["batch_size"], max_len, shuffle=True,
+                             bucket_boundaries=bucket_boundaries, sparse_input=sparse_input)
+    val_feed = create_feed(x_val_seq, x_val_stat, y_val, mode, hps["batch_size"], max_len,
+                           bucket_boundaries=bucket_boundaries, sparse_input=sparse_input)
+    fit_model(model, train_feed, val_feed, hps["batch_size"])
+
+    auc = metrics.roc_auc_score(y_true=get_targets(val_feed), y_score=predict(model, val_feed))
+
+    if return_weights:
+        return model.get_weights(), auc
+    else:
+        return model, auc
@@ -1,9 +1,6 @@
 
 import pandas as pd
 import numpy as np
-import tensorflow as tf
-tf.compat.v1.disable_v2_behavior()
-import pickle
 from sklearn import metrics
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, AdaBoostClassifier
@@ -11,34 +8,127 @@ from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.tree import DecisionTreeClassifier
 import os
-import shap
+import itertools
+import functools
+import random
+import joblib
 import src.data as data
+import src.features as features
+import src.prefixes as prefixes
+import src.hpo as hpo_engine
+import src.artifacts as artifacts
+import src.evaluation as evaluation
+import src.attribution as attribution
+import src.util as util
+
+lstm = util.lazy_import('src.lstm')  # tensorflow is only loaded by the lstm modes
 
 data_set = "sepsis"  
 n_hidden = 8
 max_len = 100 
 min_len = 3
 min_size_prefix = 1
-seed = False
+seed = False  # repetition i is seeded with seed + i. False: the seeds are drawn at random (see the metrics file)
 num_repetitions = 1
+n_jobs_repetitions = 1  # number of worker processes running repetitions in parallel (-1: one per core)
 mode = "complete"
 val_size = 0.2
 train_size = 0.7
 
 hpo = True
+n_jobs = 1  # number of worker processes training hps candidates in parallel (-1: one per core)
+search = "grid"  # "grid": every hps candidate is trained on all training data | "halving": successive halving,
+# all candidates are trained on a subsample of min_budget, only the best 1 / eta of them on eta times larger subsamples
+min_budget = 1 / 9
+eta = 3
+warm_start = True  # grid search of rf, gb and ada: one ensemble per combination of the other hps is trained with the
+# largest number of estimators and scored for every number of estimators of the grid
+memmap_prefixes = False  # store the prefix tensors as memory-mapped files in ../output/prefixes
+pipeline = "dense"  # "dense": padded prefix tensors | "streaming": lstm batches are padded while training |
+# "bucketed": like streaming, but batches contain prefixes of similar length, are only padded to their longest prefix
+# and padded time steps are masked | "sparse": lstm inputs are the column and value of the non-zero feature per time step
+bucket_boundaries = [2, 4, 8, 16, 32, 64]
+matrix_format = "dense"  # feature matrix of the baselines. "dense": float64 | "float32" | "csr": sparse float32, built
+# from the unpadded prefixes. gaussian naive bayes falls back to "float32"
+metrics_format = "csv"  # per prefix length metrics of all repetitions. "csv" | "parquet" (needs pyarrow)
+save_artifacts = True  # save the model of the best repetition with its scalers and features (see src/artifacts.py)
+artifact_root = '../model/artifacts'
+shap_background = "kmeans"  # background of the shap values. "kmeans": cluster centers of the training prefixes |
+# "stratified": stratified sample of the training prefixes
+shap_background_size = 100
+shap_chunk_size = 256  # number of prefixes explained at once
+shap_max_prefixes = None  # number of explained training prefixes (stratified sample). none: all
+n_jobs_shap = 1  # number of worker processes explaining chunks of prefixes (-1: one per core)
+shap_static = "deep"  # "deep": all inputs are explained by the DeepExplainer, values in probability space (plotted by
+# shap_plot_sepsis.py) | "analytic": shap values of the static features in closed form, only the sequential input is
+# explained by the DeepExplainer. values in logit space
+worker_settings = ['data_set', 'max_len', 'min_size_prefix', 'seed', 'mode', 'target_activity', 'hps', 'hpo',
+                   'n_jobs', 'search', 'min_budget', 'eta', 'warm_start', 'pipeline', 'bucket_boundaries',
+                   'matrix_format']  # passed to worker processes, they import this module anew
+models = {}  # registry of the best model of evaluate per (data_set, mode, target_activity), see register_model
+
+
+def save_hpos(best_hps, aucs, stages=()):
+    """
+    Writes the best hps and the validation aucs of all hps candidates into an external file.
+    :param best_hps: best hyperparameters
+    :param aucs: list of validation aucs
+    :param stages: stages of successive halving (see hpo.successive_halving), by default none
+    """
+    f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
+    for stage in stages:
+        f.write(f"Stage budget {stage['budget']}," + ",".join([f"{hps}:{auc}" for hps, auc in
+                                                                zip(stage['hps'], stage['aucs'])]) + '\n')
+    f.write(str(best_hps) + '\n')
+    f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
+    f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
+    f.write(f'Std,{np.std(aucs, ddof=1)}\n')
+    f.close()
+
+
+def register_model(data_set, mode, target_activity, model, hps):
+    """
+    Keeps a trained model in memory, e.g. the best model of evaluate for the coefficients and shap values.
+    :param data_set: dataset
+    :param mode: mode of the model
+    :param target_activity: target activity of the dataset
+    :param model: trained model
+    :param hps: hyperparameters of the model
+    """
+    models[(data_set, mode, target_activity)] = {'model': model, 'hps': hps}
 
 
-def concatenate_tensor_matrix(x_seq, x_stat):
+def get_registered_model(data_set, mode, target_activity):
     """
-    Concatenates two datasets and returns them as a matrix.
-    :param x_seq: dataset of sequential features
-    :param x_stat: dataset of static features
-    :return: concatenated dataset containing static and sequential features
+    :param data_set: dataset
+    :param mode: mode of the model
+    :param target_activity: target activity of the dataset
+    :return: registered model and its hyperparameters
     """
-    x_train_seq_ = x_seq.reshape(-1, x_seq.shape[1] * x_seq.shape[2])
-    x_concat = np.concatenate((x_train_seq_, x_stat), axis=1)
+    if (data_set, mode, target_activity) not in models:
+        raise KeyError(f'No model registered for {data_set}, {mode}, {target_activity}, run evaluate first')
+    entry = models[(data_set, mode, target_activity)]
 
-    return x_concat
+    return entry['model'], entry['hps']
+
+
+def search_hps(fit_score, candidates, grid_order=None):
+    """
+    Searches the best hps candidate with the configured search strategy and saves the validation aucs.
+    :param fit_score: function training and scoring a candidate (see hpo.grid_search)
+    :param candidates: list of (hps, spec) tuples in grid order
+    :param grid_order: by default none. list of all hps in grid order, if candidates are trained together (see
+        hpo.grid_search)
+    :return: best model and its hyperparameters
+    """
+    if search == "halving":
+        best_model, best_hpos, stages = hpo_engine.successive_halving(fit_score, candidates, min_budget, eta, n_jobs)
+        save_hpos(best_hpos, stages[-1]['aucs'], stages)
+    else:
+        best_model, best_hpos, aucs = hpo_engine.grid_search(fit_score, candidates, n_jobs, grid_order)
+        save_hpos(best_hpos, aucs)
+
+    return best_model, best_hpos
 
 
 def train_rf(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, hps, hpo):
@@ -55,42 +145,32 @@ def train_rf(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, h
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hps = ""
-        aucs = []
-
-        for num_trees in hps["rf"]["num_trees"]:
-            for max_depth_trees in hps["rf"]["max_depth_trees"]:
-                for num_rand_vars in hps["rf"]["num_rand_vars"]:
-
-                    model = RandomForestClassifier(n_estimators=num_trees, max_depth=max_depth_trees,
-                                                   max_features=num_rand_vars)
-                    model.fit(x_concat_train, np.ravel(y_train))
-                    preds_proba = model.predict_proba(x_concat_val)
-                    preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-                    auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                    aucs.append(auc)
-
-                    if auc >= max(aucs):
-                        best_model = model
-                        best_hps = {"num_trees": num_trees, "max_depth_trees": max_depth_trees,
-                                     "num_rand_vars": num_rand_vars}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hps))
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hps
+        grid = [{"num_trees": num_trees, "max_depth_trees": max_depth_trees, "num_rand_vars": num_rand_vars}
+                for num_trees in hps["rf"]["num_trees"]
+                for max_depth_trees in hps["rf"]["max_depth_trees"]
+                for num_rand_vars in hps["rf"]["num_rand_vars"]]
+
+        if warm_start and search == "grid":
+            candidates = [([{"num_trees": num_trees, "max_depth_trees": max_depth_trees, "num_rand_vars": num_rand_vars}
+                            for num_trees in hps["rf"]["num_trees"]],
+                           RandomForestClassifier(max_depth=max_depth_trees, max_features=num_rand_vars))
+                          for max_depth_trees in hps["rf"]["max_depth_trees"]
+                          for num_rand_vars in hps["rf"]["num_rand_vars"]]
+            return search_hps(functools.partial(hpo_engine.fit_score_ensemble, n_estimators=hps["rf"]["num_trees"],
+                                                x_train=x_concat_train, y_train=y_train, x_val=x_concat_val,
+                                                y_val=y_val), candidates, grid)
+
+        candidates = [(x, RandomForestClassifier(n_estimators=x["num_trees"], max_depth=x["max_depth_trees"],
+                                                 max_features=x["num_rand_vars"])) for x in grid]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = RandomForestClassifier()
@@ -113,39 +193,18 @@ def train_lr(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, h
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hpos = ""
-        aucs = []
-
-        for c in hps["lr"]["reg_strength"]:
-            for solver in hps["lr"]["solver"]:
-
-                model = LogisticRegression(C=c, solver=solver)
-                model.fit(x_concat_train, np.ravel(y_train))
-                preds_proba = model.predict_proba(x_concat_val)
-                preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-                auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                aucs.append(auc)
-
-                if auc >= max(aucs):
-                    best_model = model
-                    best_hpos = {"c": c, "solver": solver}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hpos))
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hpos
+        candidates = [({"c": c, "solver": solver}, LogisticRegression(C=c, solver=solver))
+                      for c in hps["lr"]["reg_strength"]
+                      for solver in hps["lr"]["solver"]]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = LogisticRegression()
@@ -168,39 +227,29 @@ def train_gb(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, h
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hpos = ""
-        aucs = []
-
-        for n_estimators in hps["gb"]["n_estimators"]:
-            for learning_rate in hps["gb"]["learning_rate"]:
-
-                model = GradientBoostingClassifier(n_estimators=n_estimators, learning_rate=learning_rate)
-                model.fit(x_concat_train, np.ravel(y_train))
-                preds_proba = model.predict_proba(x_concat_val)
-                preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-                auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                aucs.append(auc)
-
-                if auc >= max(aucs):
-                    best_model = model
-                    best_hpos = {"n_estimators": n_estimators, "learning_rate": learning_rate}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hpos))
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hpos
+        grid = [{"n_estimators": n_estimators, "learning_rate": learning_rate}
+                for n_estimators in hps["gb"]["n_estimators"]
+                for learning_rate in hps["gb"]["learning_rate"]]
+
+        if warm_start and search == "grid":
+            candidates = [([{"n_estimators": n_estimators, "learning_rate": learning_rate}
+                            for n_estimators in hps["gb"]["n_estimators"]],
+                           GradientBoostingClassifier(learning_rate=learning_rate))
+                          for learning_rate in hps["gb"]["learning_rate"]]
+            return search_hps(functools.partial(hpo_engine.fit_score_ensemble, n_estimators=hps["gb"]["n_estimators"],
+                                                x_train=x_concat_train, y_train=y_train, x_val=x_concat_val,
+                                                y_val=y_val), candidates, grid)
+
+        candidates = [(x, GradientBoostingClassifier(n_estimators=x["n_estimators"], learning_rate=x["learning_rate"])) for x in grid]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = GradientBoostingClassifier()
@@ -223,39 +272,29 @@ def train_ada(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val,
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hpos = ""
-        aucs = []
-
-        for n_estimators in hps["ada"]["n_estimators"]:
-            for learning_rate in hps["ada"]["learning_rate"]:
-
-                model = AdaBoostClassifier(n_estimators=n_estimators, learning_rate=learning_rate)
-                model.fit(x_concat_train, np.ravel(y_train))
-                preds_proba = model.predict_proba(x_concat_val)
-                preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-                auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                aucs.append(auc)
-
-                if auc >= max(aucs):
-                    best_model = model
-                    best_hpos = {"n_estimators": n_estimators, "learning_rate": learning_rate}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hpos) + '\n')
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hpos
+        grid = [{"n_estimators": n_estimators, "learning_rate": learning_rate}
+                for n_estimators in hps["ada"]["n_estimators"]
+                for learning_rate in hps["ada"]["learning_rate"]]
+
+        if warm_start and search == "grid":
+            candidates = [([{"n_estimators": n_estimators, "learning_rate": learning_rate}
+                            for n_estimators in hps["ada"]["n_estimators"]],
+                           AdaBoostClassifier(learning_rate=learning_rate))
+                          for learning_rate in hps["ada"]["learning_rate"]]
+            return search_hps(functools.partial(hpo_engine.fit_score_ensemble, n_estimators=hps["ada"]["n_estimators"],
+                                                x_train=x_concat_train, y_train=y_train, x_val=x_concat_val,
+                                                y_val=y_val), candidates, grid)
+
+        candidates = [(x, AdaBoostClassifier(n_estimators=x["n_estimators"], learning_rate=x["learning_rate"])) for x in grid]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = AdaBoostClassifier()
@@ -278,38 +317,18 @@ def train_nb(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val, h
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    nb_matrix_format = "float32" if matrix_format == "csr" else matrix_format  # no sparse input
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, nb_matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, nb_matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hpos = ""
-        aucs = []
-
-        for var_smoothing in hps["nb"]["var_smoothing"]:
-
-            model = GaussianNB(var_smoothing=var_smoothing)
-            model.fit(x_concat_train, np.ravel(y_train))
-            preds_proba = model.predict_proba(x_concat_val)
-            preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-            auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-            aucs.append(auc)
-
-            if auc >= max(aucs):
-                best_model = model
-                best_hpos = {"var_smoothing": var_smoothing}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hpos) + '\n')
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hpos
+        candidates = [({"var_smoothing": var_smoothing}, GaussianNB(var_smoothing=var_smoothing))
+                      for var_smoothing in hps["nb"]["var_smoothing"]]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = GaussianNB()
@@ -332,38 +351,17 @@ def train_knn(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val,
     :param hpo: true: model and hps will be determined and returned | false: only model will be returned
     :return: ml model and hyperparameters or just the ml model
     """
-    x_concat_train = concatenate_tensor_matrix(x_train_seq, x_train_stat)
-    x_concat_val = concatenate_tensor_matrix(x_val_seq, x_val_stat)
+    x_concat_train = features.get_feature_matrix(x_train_seq, x_train_stat, matrix_format, max_len)
+    x_concat_val = features.get_feature_matrix(x_val_seq, x_val_stat, matrix_format, max_len)
 
     if hpo:
-        best_model = ""
-        best_hpos = ""
-        aucs = []
-
-        for n_neighbors in hps["knn"]["n_neighbors"]:
-
-            model = KNeighborsClassifier(n_neighbors=n_neighbors)
-            model.fit(x_concat_train, np.ravel(y_train))
-            preds_proba = model.predict_proba(x_concat_val)
-            preds_proba = [pred_proba[1] for pred_proba in preds_proba]
-            auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-            aucs.append(auc)
-
-            if auc >= max(aucs):
-                best_model = model
-                best_hpos = {"n_eighbors": n_neighbors}
-
-        f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-        f.write(str(best_hpos) + '\n')
-        f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-        f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-        f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-        f.close()
-
-        return best_model, best_hpos
+        candidates = [({"n_eighbors": n_neighbors}, KNeighborsClassifier(n_neighbors=n_neighbors))
+                      for n_neighbors in hps["knn"]["n_neighbors"]]
+        return search_hps(functools.partial(hpo_engine.fit_score_sklearn, x_train=x_concat_train, y_train=y_train,
+                                            x_val=x_concat_val, y_val=y_val), candidates)
 
     else:
-        x_concat = np.concatenate((x_concat_train, x_concat_val), axis=0)
+        x_concat = features.concatenate_rows(x_concat_train, x_concat_val)
         y = np.concatenate((y_train, y_val), axis=0)
 
         model = KNeighborsClassifier()
@@ -374,14 +372,15 @@ def train_knn(x_train_seq, x_train_stat, y_train, x_val_seq, x_val_stat, y_val,
 
 
 def train_lstm(x_train_seq, x_train_stat, y_train, x_val_seq=False, x_val_stat=False, y_val=False, hps=False,
-               hpo=False, mode="complete"):
+               hpo=False, mode="complete", init_weights=None):
     """
     Trains an long short-term memory model with the input data and returns the model as well as the hyperparameters,if selected.
     best hps will be saved in an external file.
-    :param x_train_seq: trainingsdataset (sequential features)
+    :param x_train_seq: trainingsdataset (sequential features) or prefix store (see prefixes.create_prefix_store),
+        then the batches are padded while training
     :param x_train_stat: trainingsdataset (static features)
     :param y_train: trainingsdataset (target attribute)
-    :param x_val_seq: validation dataset (sequential features)
+    :param x_val_seq: validation dataset (sequential features) or prefix store
     :param x_val_stat: validation dataset (static features)
     :param y_val: validation dataset (target attribute)
     :param hps: hyperparameters
@@ -390,366 +389,88 @@ def train_lstm(x_train_seq, x_train_stat, y_train, x_val_seq=False, x_val_stat=F
         mode = "complete": both datasets will be used (default setting)
         mode = "static": only the static features will be used
         mode = "sequential": only the sequential features will be used
+    :param init_weights: by default none. if set and hpo is false, training continues from these weights (e.g. of a
+        registered model, see register_model) instead of a random initialization
     :return: ml model and hyperparameters or just the ml model
     """
-    max_case_len = x_train_seq.shape[1]
-    num_features_seq = x_train_seq.shape[2]
-    num_features_stat = x_train_stat.shape[1]
-
-    if mode == "complete":
-
-        if hpo:
-            best_model = ""
-            best_hpos = ""
-            aucs = []
-
-            for size in hps["complete"]["size"]:
-                for learning_rate in hps["complete"]["learning_rate"]:
-                    for batch_size in hps["complete"]["batch_size"]:
-
-                        input_layer_seq = tf.keras.layers.Input(shape=(max_case_len, num_features_seq),
-                                                                name='seq_input_layer')
-                        input_layer_static = tf.keras.layers.Input(shape=(num_features_stat), name='static_input_layer')
-
-                        hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(
-                            units=size,
-                            return_sequences=False))(input_layer_seq)
-
-                        concatenate_layer = tf.keras.layers.Concatenate(axis=1)([hidden_layer, input_layer_static])
-
-                        output_layer = tf.keras.layers.Dense(1,
-                                                             activation='sigmoid',
-                                                             name='output_layer')(concatenate_layer)
-
-                        model = tf.keras.models.Model(inputs=[input_layer_seq, input_layer_static],
-                                                      outputs=[output_layer])
-
-                        opt = tf.keras.optimizers.Adam(learning_rate=learning_rate)
-
-                        model.compile(loss='binary_crossentropy',
-                                      optimizer=opt,
-                                      metrics=['accuracy'])
-                        early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-                        model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                              monitor='val_loss',
-                                                                              verbose=0,
-                                                                              save_best_only=True,
-                                                                              save_weights_only=False,
-                                                                              mode='auto')
-
-                        lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                                          factor=0.5,
-                                                                          patience=10,
-                                                                          verbose=0,
-                                                                          mode='auto',
-                                                                          min_delta=0.0001,
-                                                                          cooldown=0,
-                                                                          min_lr=0)
-
-                        model.summary()
-                        model.fit([x_train_seq, x_train_stat], y_train,
-                                  validation_data=([x_val_seq, x_val_stat], y_val),
-                                  verbose=1,
-                                  callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                                  batch_size=batch_size,
-                                  epochs=100)
-
-                        preds_proba = model.predict([x_val_seq, x_val_stat])
-                        preds_proba = [pred_proba[0] for pred_proba in preds_proba]
-
-                        auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                        aucs.append(auc)
-
-                        if auc >= max(aucs):
-                            best_model = model
-                            best_hpos = {"size": size, "learning_rate": learning_rate, "batch_size": batch_size}
-
-            f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-            f.write(str(best_hpos) + '\n')
-            f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-            f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-            f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-            f.close()
+    bucketed = pipeline == "bucketed" and isinstance(x_train_seq, dict)
+    sparse_input = pipeline == "sparse" and isinstance(x_train_seq, dict)
+    max_case_len, num_features_seq, num_features_stat = lstm.get_input_shape(x_train_seq, x_train_stat, max_len)
 
-            return best_model, best_hpos
+    if hpo:
+        hps_names = [name for name in ["size", "learning_rate", "batch_size"] if name in hps[mode]]
+        candidates = [(dict(zip(hps_names, hps_values)), dict(zip(hps_names, hps_values)))
+                      for hps_values in itertools.product(*[hps[mode][name] for name in hps_names])]
 
-        else:
-            input_layer_seq = tf.keras.layers.Input(shape=(max_case_len, num_features_seq), name='seq_input_layer')
-            input_layer_static = tf.keras.layers.Input(shape=(num_features_stat), name='static_input_layer')
-
-            hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(
-                units=hps['size'],
-                return_sequences=False))(input_layer_seq)
-
-            concatenate_layer = tf.keras.layers.Concatenate(axis=1)([hidden_layer, input_layer_static])
-
-            output_layer = tf.keras.layers.Dense(1,
-                                                 activation='sigmoid',
-                                                 name='output_layer')(concatenate_layer)
-
-            model = tf.keras.models.Model(inputs=[input_layer_seq, input_layer_static],
-                                          outputs=[output_layer])
-
-            opt = tf.keras.optimizers.Adam(learning_rate=hps['learning_rate'])
-            model.compile(loss='binary_crossentropy',
-                          optimizer=opt,
-                          metrics=['accuracy'])
-            early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-            model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                  monitor='val_loss',
-                                                                  verbose=0,
-                                                                  save_best_only=True,
-                                                                  save_weights_only=False,
-                                                                  mode='auto')
-
-            lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                              factor=0.5,
-                                                              patience=10,
-                                                              verbose=0,
-                                                              mode='auto',
-                                                              min_delta=0.0001,
-                                                              cooldown=0,
-                                                              min_lr=0)
-
-            model.summary()
-            model.fit([x_train_seq, x_train_stat], y_train,
-                      validation_data=([x_val_seq, x_val_stat], y_val),
-                      verbose=1,
-                      callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                      batch_size=hps['batch_size'],
-                      epochs=100)
-
-            return model
-
-    if mode == "static":
-
-        if hpo:
-            best_model = ""
-            best_hpos = ""
-            aucs = []
-
-            for learning_rate in hps["complete"]["learning_rate"]:
-                for batch_size in hps["complete"]["batch_size"]:
-
-                    input_layer_static = tf.keras.layers.Input(shape=(num_features_stat), name='static_input_layer')
-
-                    output_layer = tf.keras.layers.Dense(1,
-                                                         activation='sigmoid',
-                                                         name='output_layer')(input_layer_static)
-
-                    model = tf.keras.models.Model(inputs=[input_layer_static],
-                                                  outputs=[output_layer])
-
-                    opt = tf.keras.optimizers.Adam(learning_rate=learning_rate)
-
-                    model.compile(loss='binary_crossentropy',
-                                  optimizer=opt,
-                                  metrics=['accuracy'])
-                    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-                    model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                          monitor='val_loss',
-                                                                          verbose=0,
-                                                                          save_best_only=True,
-                                                                          save_weights_only=False,
-                                                                          mode='auto')
-
-                    lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                                      factor=0.5,
-                                                                      patience=10,
-                                                                      verbose=0,
-                                                                      mode='auto',
-                                                                      min_delta=0.0001,
-                                                                      cooldown=0,
-                                                                      min_lr=0)
-
-                    model.summary()
-                    model.fit([x_train_stat], y_train,
-                              validation_data=([x_val_stat], y_val),
-                              verbose=1,
-                              callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                              batch_size=batch_size,
-                              epochs=100)
-
-                    preds_proba = model.predict([x_val_stat])
-                    preds_proba = [pred_proba[0] for pred_proba in preds_proba]
-
-                    auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                    aucs.append(auc)
-
-                    if auc >= max(aucs):
-                        best_model = model
-                        best_hpos = {"learning_rate": learning_rate, "batch_size": batch_size}
-
-            f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-            f.write(str(best_hpos) + '\n')
-            f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-            f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-            f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-            f.close()
+        best_model, best_hpos = search_hps(
+            functools.partial(lstm.fit_score, mode=mode, x_train_seq=x_train_seq, x_train_stat=x_train_stat,
+                              y_train=y_train, x_val_seq=x_val_seq, x_val_stat=x_val_stat, y_val=y_val,
+                              max_len=max_len, bucket_boundaries=bucket_boundaries if bucketed else None,
+                              sparse_input=sparse_input, return_weights=n_jobs != 1), candidates)
 
-            return best_model, best_hpos
+        if n_jobs != 1:  # models are trained in worker processes, only their weights are returned
+            best_model = get_lstm_model(best_model, best_hpos, mode, x_train_seq, x_train_stat)
 
-        else:
-            input_layer_static = tf.keras.layers.Input(shape=(num_features_stat), name='static_input_layer')
-
-            output_layer = tf.keras.layers.Dense(1,
-                                                 activation='sigmoid',
-                                                 name='output_layer')(input_layer_static)
-
-            model = tf.keras.models.Model(inputs=[input_layer_static],
-                                          outputs=[output_layer])
-
-            opt = tf.keras.optimizers.Adam(learning_rate=0.001)
-            model.compile(loss='binary_crossentropy',
-                          optimizer=opt,
-                          metrics=['accuracy'])
-            early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-            model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                  monitor='val_loss',
-                                                                  verbose=0,
-                                                                  save_best_only=True,
-                                                                  save_weights_only=False,
-                                                                  mode='auto')
-
-            lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                              factor=0.5,
-                                                              patience=10,
-                                                              verbose=0,
-                                                              mode='auto',
-                                                              min_delta=0.0001,
-                                                              cooldown=0,
-                                                              min_lr=0)
-
-            model.summary()
-            model.fit([x_train_stat], y_train,
-                      validation_data=([x_val_seq, x_val_stat], y_val),
-                      verbose=1,
-                      callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                      batch_size=32,
-                      epochs=100)
-
-            return model
-
-    if mode == "sequential":
-
-        if hpo:
-            best_model = ""
-            best_hpos = ""
-            aucs = []
-
-            for size in hps["complete"]["size"]:
-                for learning_rate in hps["complete"]["learning_rate"]:
-                    for batch_size in hps["complete"]["batch_size"]:
-
-                        input_layer_seq = tf.keras.layers.Input(shape=(max_case_len, num_features_seq),
-                                                                name='seq_input_layer')
-
-                        hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(
-                            units=size,
-                            return_sequences=False))(input_layer_seq)
-
-                        output_layer = tf.keras.layers.Dense(1,
-                                                             activation='sigmoid',
-                                                             name='output_layer')(hidden_layer)
-
-                        model = tf.keras.models.Model(inputs=[input_layer_seq],
-                                                      outputs=[output_layer])
-
-                        opt = tf.keras.optimizers.Adam(learning_rate=learning_rate)
-
-                        model.compile(loss='binary_crossentropy',
-                                      optimizer=opt,
-                                      metrics=['accuracy'])
-
-                        early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-                        model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                              monitor='val_loss',
-                                                                              verbose=0,
-                                                                              save_best_only=True,
-                                                                              save_weights_only=False,
-                                                                              mode='auto')
-
-                        lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                                          factor=0.5,
-                                                                          patience=10,
-                                                                          verbose=0,
-                                                                          mode='auto',
-                                                                          min_delta=0.0001,
-                                                                          cooldown=0,
-                                                                          min_lr=0)
-
-                        model.summary()
-                        model.fit([x_train_seq], y_train,
-                                  validation_data=([x_val_seq, x_val_stat], y_val),
-                                  verbose=1,
-                                  callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                                  batch_size=batch_size,
-                                  epochs=100)
-
-                        preds_proba = model.predict([x_val_seq, x_val_stat])
-                        preds_proba = [pred_proba[0] for pred_proba in preds_proba]
-
-                        auc = metrics.roc_auc_score(y_true=y_val, y_score=preds_proba)
-                        aucs.append(auc)
-
-                        if auc >= max(aucs):
-                            best_model = model
-                            best_hpos = {"size": size, "learning_rate": learning_rate, "batch_size": batch_size}
-
-            f = open(f'../output/{data_set}_{mode}_{target_activity}_hpos.txt', 'a+')
-            f.write(str(best_hpos) + '\n')
-            f.write("Validation aucs," + ",".join([str(x) for x in aucs]) + '\n')
-            f.write(f'Avg,{sum(aucs) / len(aucs)}\n')
-            f.write(f'Std,{np.std(aucs, ddof=1)}\n')
-            f.close()
+        return best_model, best_hpos
 
-            return best_model, best_hpos
+    else:
+        if mode != "complete":  # default hyperparameters
+            hps = {"size": 4, "learning_rate": 0.001, "batch_size": 32}
+
+        model = lstm.build_model(mode, hps.get("size"), hps["learning_rate"], max_case_len, num_features_seq,
+                                 num_features_stat, masking=bucketed, sparse_input=sparse_input)
+        if init_weights is not None:
+            model.set_weights(init_weights)
+        train_feed = lstm.create_feed(x_train_seq, x_train_stat, y_train, mode, hps["batch_size"], max_len,
+                                      shuffle=True, bucket_boundaries=bucket_boundaries if bucketed else None,
+                                      sparse_input=sparse_input)
+        val_feed = lstm.create_feed(x_val_seq, x_val_stat, y_val, mode, hps["batch_size"], max_len,
+                                    bucket_boundaries=bucket_boundaries if bucketed else None,
+                                    sparse_input=sparse_input)
+        lstm.fit_model(model, train_feed, val_feed, hps["batch_size"])
 
-        else:
+        return model
 
-            input_layer_seq = tf.keras.layers.Input(shape=(max_case_len, num_features_seq), name='seq_input_layer')
-
-            hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(
-                units=4,
-                return_sequences=False))(input_layer_seq)
-
-            output_layer = tf.keras.layers.Dense(1,
-                                                 activation='sigmoid',
-                                                 name='output_layer')(hidden_layer)
-
-            model = tf.keras.models.Model(inputs=[input_layer_seq],
-                                          outputs=[output_layer])
-
-            opt = tf.keras.optimizers.Adam(learning_rate=0.001)
-            model.compile(loss='binary_crossentropy',
-                          optimizer=opt,
-                          metrics=['accuracy'])
-            early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
-            model_checkpoint = tf.keras.callbacks.ModelCheckpoint('../model/model.ckpt',
-                                                                  monitor='val_loss',
-                                                                  verbose=0,
-                                                                  save_best_only=True,
-                                                                  save_weights_only=False,
-                                                                  mode='auto')
-
-            lr_reducer = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss',
-                                                              factor=0.5,
-                                                              patience=10,
-                                                              verbose=0,
-                                                              mode='auto',
-                                                              min_delta=0.0001,
-                                                              cooldown=0,
-                                                              min_lr=0)
-
-            model.summary()
-            model.fit([x_train_seq], y_train,
-                      validation_data=([x_val_seq, x_val_stat], y_val),
-                      verbose=1,
-                      callbacks=[early_stopping, model_checkpoint, lr_reducer],
-                      batch_size=32,
-                      epochs=100)
-
-            return model
+
+def get_lstm_model(weights, hps, mode, x_train_seq, x_train_stat):
+    """
+    Rebuilds an lstm model trained in a worker process from its weights.
+    :param weights: weights of the model
+    :param hps: hyperparameters of the model
+    :param mode: architecture of the model (see train_lstm)
+    :param x_train_seq: training dataset (sequential features) or prefix store the model was trained on
+    :param x_train_stat: training dataset (static features)
+    :return: compiled model with the weights
+    """
+    bucketed = pipeline == "bucketed" and isinstance(x_train_seq, dict)
+    sparse_input = pipeline == "sparse" and isinstance(x_train_seq, dict)
+    max_case_len, num_features_seq, num_features_stat = lstm.get_input_shape(x_train_seq, x_train_stat, max_len)
+
+    model = lstm.build_model(mode, hps.get("size"), hps["learning_rate"], max_case_len, num_features_seq,
+                             num_features_stat, masking=bucketed, sparse_input=sparse_input)
+    model.set_weights(weights)
+
+    return model
+
+
+def get_settings():
+    """
+    :return: dictionary of the settings worker processes need to train a model (see worker_settings), e.g. the
+        configuration above and the target activity of the running experiment
+    """
+    return {name: globals()[name] for name in worker_settings if name in globals()}
+
+
+def set_seed(repetition_seed, mode):
+    """
+    Seeds the random number generators of python, numpy and, for the lstm modes, tensorflow.
+    :param repetition_seed: seed
+    :param mode: determines how the ml model will be trained
+    """
+    random.seed(repetition_seed)
+    np.random.seed(repetition_seed)
+    if mode in ["complete", "static", "sequential"]:
+        lstm.set_seed(repetition_seed)
 
 
 def correct_static(seq, seqs_time, idx_sample, idx_time):
@@ -777,7 +498,8 @@ def correct_static(seq, seqs_time, idx_sample, idx_time):
     return seq
 
 
-def time_step_blow_up(X_seq, X_stat, y, max_len, ts_info=False, x_time=None, x_time_vals=None, x_statics_vals_corr=None):
+def time_step_blow_up(X_seq, X_stat, y, max_len, ts_info=False, x_time=None, x_time_vals=None, x_statics_vals_corr=None,
+                      memmap_path=None, ragged=False):
     """
     Blows up the time steps by generating longer prefixes.
     :param X_seq: sequential feature dataset
@@ -788,6 +510,10 @@ def time_step_blow_up(X_seq, X_stat, y, max_len, ts_info=False, x_time=None, x_t
     :param x_time: by default none. point in time used for deleting prefixes
     :param x_time_vals: by default none. a list of time stamps for every sequence in X_seq
     :param x_statics_vals_corr: never used, is none by default
+    :param memmap_path: by default none. if set, the prefix tensors are stored as memory-mapped files in a directory
+        starting with this path and are reopened from there, if they were already created from the same data
+    :param ragged: if true, the prefixes are not padded. the prefix store (see prefixes.create_prefix_store) is returned
+        instead of X_seq_final and none instead of X_static_final
     :return: 4 return values:
         X_seq_final: a 3-d vector representing the prefixes of the sequential dataset
         X_static_final: a 2-d vector representing the prefixes of the static dataset
@@ -795,38 +521,41 @@ def time_step_blow_up(X_seq, X_stat, y, max_len, ts_info=False, x_time=None, x_t
         ts: additional timestamp information (optional)
     """
 
-    X_seq_prefix, X_stat_prefix, y_prefix, x_time_vals_prefix, ts = [], [], [], [], []
+    if memmap_path is not None and not ragged:
+        memmap_path = prefixes.get_prefix_store_path(memmap_path, [X_seq, X_stat, y, x_time_vals or [], max_len,
+                                                                   min_size_prefix, x_time])
+        tensors = prefixes.load_prefix_tensors(memmap_path)
 
-    for idx_seq in range(0, len(X_seq)):
-        for idx_ts in range(min_size_prefix, len(X_seq[idx_seq]) + 1):
-            X_seq_prefix.append(X_seq[idx_seq][0:idx_ts])
-            X_stat_prefix.append(X_stat[idx_seq])
-            y_prefix.append(y[idx_seq])
-            if x_time is not None:
-                x_time_vals_prefix.append(x_time_vals[idx_seq][0:idx_ts])
-            ts.append(idx_ts)
+        if tensors is not None:
+            X_seq_final, X_stat_final, y_final, ts = tensors
+            if ts_info:
+                return X_seq_final, X_stat_final, y_final, ts.tolist()
+            else:
+                return X_seq_final, X_stat_final, y_final
 
-    
-    # Remove prefixes with future event from training set
+    # Prefixes with future event are not created for the training set
     if x_time is not None:
-        X_seq_prefix_temp, X_stat_prefix_temp, y_prefix_temp, ts_temp = [], [], [], []
-
-        for idx_prefix in range(0, len(X_seq_prefix)):
-            if x_time_vals_prefix[idx_prefix][-1].value <= x_time.value:
-                X_seq_prefix_temp.append(X_seq_prefix[idx_prefix])
-                X_stat_prefix_temp.append(X_stat_prefix[idx_prefix])
-                y_prefix_temp.append(y_prefix[idx_prefix])
-                ts_temp.append(ts[idx_prefix])
+        store = prefixes.create_prefix_store(X_seq, X_stat, y, min_size_prefix, x_time_vals, max_time=x_time.value)
+    else:
+        store = prefixes.create_prefix_store(X_seq, X_stat, y, min_size_prefix)
 
-        X_seq_prefix, X_stat_prefix, y_prefix, ts = X_seq_prefix_temp, X_stat_prefix_temp, y_prefix_temp, ts_temp
+    ts = store['index'][:, 1].tolist()
 
     # Vectorization
-    X_seq_final = np.zeros((len(X_seq_prefix), max_len, len(X_seq_prefix[0][0])), dtype=np.float32)
-    X_stat_final = np.zeros((len(X_seq_prefix), len(X_stat_prefix[0])))
-    for i, x in enumerate(X_seq_prefix):
-        X_seq_final[i, :len(x), :] = np.array(x)
-        X_stat_final[i, :] = np.array(X_stat_prefix[i])
-    y_final = np.array(y_prefix).astype(np.int32)
+    if ragged:
+        X_seq_final, X_stat_final, y_final = store, None, store['y'][store['index'][:, 0]].astype(np.int32)
+    elif memmap_path is not None:
+        tensors = prefixes.create_prefix_tensors(memmap_path, len(store['index']), max_len,
+                                                 store['events'].shape[1], store['statics'].shape[1])
+        for start in range(0, len(store['index']), prefixes.chunk_size):
+            rows = slice(start, start + prefixes.chunk_size)
+            tensors[0][rows], tensors[1][rows], tensors[2][rows] = prefixes.get_prefix_batch(store, rows, max_len)
+        tensors[3][:] = ts
+
+        prefixes.save_prefix_tensors(memmap_path, tensors)
+        X_seq_final, X_stat_final, y_final, _ = prefixes.load_prefix_tensors(memmap_path)
+    else:
+        X_seq_final, X_stat_final, y_final = prefixes.get_prefix_batch(store, slice(None), max_len)
 
     if ts_info:
         return X_seq_final, X_stat_final, y_final, ts
@@ -834,7 +563,99 @@ def time_step_blow_up(X_seq, X_stat, y, max_len, ts_info=False, x_time=None, x_t
         return X_seq_final, X_stat_final, y_final
 
 
-def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_time=None, x_statics_vals_corr=None):
+def run_repetition(repetition_seed, mode, hps, hpo, X_train_seq, X_train_stat, y_train, X_val_seq, X_val_stat, y_val,
+                   X_test_seq, X_test_stat, y_test, return_weights=False, settings=None):
+    """
+    Trains the ml model of one repetition and predicts the test set.
+    :param repetition_seed: seed of the repetition (see set_seed)
+    :param mode: determines how the ml model will be trained
+    :param hps: hyperparameters
+    :param hpo: true: model and hps will be determined by the called training functions
+    :param X_train_seq: training dataset (sequential features) or prefix store
+    :param X_train_stat: training dataset (static features)
+    :param y_train: training dataset (target attribute)
+    :param X_val_seq: validation dataset (sequential features) or prefix store
+    :param X_val_stat: validation dataset (static features)
+    :param y_val: validation dataset (target attribute)
+    :param X_test_seq: test dataset (sequential features) or prefix store
+    :param X_test_stat: test dataset (static features)
+    :param y_test: test dataset (target attribute)
+    :param return_weights: if true, the weights of an lstm model are returned instead of the model (run in a worker
+        process, a model cannot be passed back)
+    :param settings: settings of the calling process (see get_settings). by default none. worker processes import
+        this module anew and need the settings changed at runtime, e.g. the target activity
+    :return: ml model or its weights, best hps, predicted classes and predicted probabilities of the test set
+    """
+    if settings is not None:
+        globals().update(settings)
+    set_seed(repetition_seed, mode)
+
+    if mode in ["complete", "static", "sequential"]:
+        model, best_hps = train_lstm(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                      y_val.reshape(-1, 1), hps, hpo, mode)
+        test_feed = lstm.create_feed(X_test_seq, X_test_stat, y_test, mode, 32, max_len,
+                                     bucket_boundaries=bucket_boundaries if pipeline == "bucketed" else None,
+                                     sparse_input=pipeline == "sparse")
+        preds_proba = lstm.predict(model, test_feed)
+        preds = [int(round(pred)) for pred in preds_proba]
+        preds_proba = list(preds_proba)
+
+        if return_weights:
+            model = model.get_weights()
+
+    elif mode == "rf":
+        model, best_hps = train_rf(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                    y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(X_test_seq, X_test_stat, matrix_format,
+                                                                      max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    elif mode == "lr":
+        model, best_hps = train_lr(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                    y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(X_test_seq, X_test_stat, matrix_format,
+                                                                      max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    elif mode == "gb":
+        model, best_hps = train_gb(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                    y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(X_test_seq, X_test_stat, matrix_format,
+                                                                      max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    elif mode == "ada":
+        model, best_hps = train_ada(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                     y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(X_test_seq, X_test_stat, matrix_format,
+                                                                      max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    elif mode == "nb":
+        model, best_hps = train_nb(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                    y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(
+            X_test_seq, X_test_stat, "float32" if matrix_format == "csr" else matrix_format, max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    elif mode == "knn":
+        model, best_hps = train_knn(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
+                                     y_val.reshape(-1, 1), hps, hpo)
+        preds_proba = model.predict_proba(features.get_feature_matrix(X_test_seq, X_test_stat, matrix_format,
+                                                                      max_len))
+        preds = [np.argmax(pred_proba) for pred_proba in preds_proba]
+        preds_proba = [pred_proba[1] for pred_proba in preds_proba]
+
+    return model, best_hps, preds, preds_proba
+
+
+def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_time=None, x_statics_vals_corr=None,
+             scalers=None, seq_features=None, static_features=None):
     """
     Evaluates the predictive performance of the ml model.
     :param x_seqs: sequential features datasets
@@ -847,6 +668,10 @@ def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_
     :param hpo: true: model and hps will be determined and returned by the called training functions | false: only model will be returned by the called training functions
     :param x_time: list of timestamps; none by default
     :param x_statics_vals_corr: corrected values of static features; none by default
+    :param scalers: normalization constants of the dataset (see data.fit_sepsis_scalers); none by default, then no
+        artifact is saved
+    :param seq_features: list of sequence features; none by default, then those of data.get_sepsis_features
+    :param static_features: list of static features; none by default, then those of data.get_sepsis_features
     :return: multiple objects:
         X_train_seq = sequential data for training
         X_train_stat = static Data for training
@@ -855,6 +680,7 @@ def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_
         X_val_stat = static data for validation
         y_val = target attribute for validation
         best_hps_repetitions = best hps. value = "", if hpo = false
+        best_model = model of the repetition with the best auc, also registered (see register_model)
     """
     data_index = list(range(0, len(y)))
     val_index = data_index[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))]
@@ -866,204 +692,172 @@ def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_
         x_time_train = x_time[0: int(train_size * (1 - val_size) * len(y))]
         x_time_val = x_time[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))]
 
-    results = {}
-    best_hps_repetitions = ""
+    if mode in ["complete", "static", "sequential"]:
+        ragged = pipeline in ["streaming", "bucketed", "sparse"]
+    else:
+        ragged = matrix_format == "csr"  # the sparse feature matrix is built from the prefix store
+    memmap_paths = {split: f'../output/prefixes/{data_set}_{target_activity}_{split}' if memmap_prefixes else None
+                    for split in ['train', 'val', 'test']}
 
-    for repetition in range(0, num_repetitions):
-
-        # Timestamp exists
-        if x_time is not None:
-            if x_statics_vals_corr is not None:
-                X_train_seq, X_train_stat, y_train = time_step_blow_up(x_seqs[0: int(train_size * (1 - val_size) * len(y))],
-                                                                       x_statics[0: int(train_size * (1 - val_size) * len(y))],
-                                                                       y[0: int(train_size * (1 - val_size) * len(y))],
-                                                                       max_len,
-                                                                       ts_info=False,
-                                                                       x_time=time_start_val,
-                                                                       x_time_vals=x_time_train,
-                                                                       x_statics_vals_corr=x_statics_vals_corr[0: int(train_size * (1 - val_size) * len(y))])
-
-                X_val_seq, X_val_stat, y_val = time_step_blow_up(
-                    x_seqs[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    x_statics[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    y[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    max_len,
-                    ts_info=False,
-                    x_time=time_start_test,
-                    x_time_vals=x_time_val,
-                    x_statics_vals_corr=x_statics_vals_corr[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))])
+    results = {'all': {'rep': [], 'auc': []}}
+    metrics_repetitions = []
+    best_hps_repetitions = ""
 
-            else:
-                X_train_seq, X_train_stat, y_train = time_step_blow_up(
-                    x_seqs[0: int(train_size * (1 - val_size) * len(y))],
-                    x_statics[0: int(train_size * (1 - val_size) * len(y))],
-                    y[0: int(train_size * (1 - val_size) * len(y))],
-                    max_len,
-                    ts_info=False,
-                    x_time=time_start_val,
-                    x_time_vals=x_time_train,
-                    x_statics_vals_corr=None)
-
-                X_val_seq, X_val_stat, y_val = time_step_blow_up(
-                    x_seqs[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    x_statics[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    y[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                    max_len,
-                    ts_info=False,
-                    x_time=time_start_test,
-                    x_time_vals=x_time_val,
-                    x_statics_vals_corr=None)
-
-        # No timestamp exists
-        else:
+    # Prefix tensors, built once for all repetitions
+    # Timestamp exists
+    if x_time is not None:
+        if x_statics_vals_corr is not None:
             X_train_seq, X_train_stat, y_train = time_step_blow_up(x_seqs[0: int(train_size * (1 - val_size) * len(y))],
-                                                                   x_statics[
-                                                                   0: int(train_size * (1 - val_size) * len(y))],
+                                                                   x_statics[0: int(train_size * (1 - val_size) * len(y))],
                                                                    y[0: int(train_size * (1 - val_size) * len(y))],
-                                                                   max_len)
+                                                                   max_len,
+                                                                   ts_info=False,
+                                                                   x_time=time_start_val,
+                                                                   x_time_vals=x_time_train,
+                                                                   x_statics_vals_corr=x_statics_vals_corr[0: int(train_size * (1 - val_size) * len(y))],
+                                                                   memmap_path=memmap_paths['train'],
+                                                                   ragged=ragged)
 
             X_val_seq, X_val_stat, y_val = time_step_blow_up(
                 x_seqs[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
                 x_statics[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
                 y[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
-                max_len)
+                max_len,
+                ts_info=False,
+                x_time=time_start_test,
+                x_time_vals=x_time_val,
+                x_statics_vals_corr=x_statics_vals_corr[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+                memmap_path=memmap_paths['val'],
+                ragged=ragged)
 
-        if x_statics_vals_corr is not None:
-            X_test_seq, X_test_stat, y_test, ts = time_step_blow_up(x_seqs[int(train_size * len(y)):],
-                                                                    x_statics[int(train_size * len(y)):],
-                                                                    y[int(train_size * len(y)):],
-                                                                    max_len,
-                                                                    ts_info=True,
-                                                                    x_statics_vals_corr=x_statics_vals_corr[int(train_size * len(y)):])
         else:
-            X_test_seq, X_test_stat, y_test, ts = time_step_blow_up(x_seqs[int(train_size * len(y)):],
-                                                                    x_statics[int(train_size * len(y)):],
-                                                                    y[int(train_size * len(y)):],
-                                                                    max_len,
-                                                                    ts_info=True,
-                                                                    x_statics_vals_corr=None)
-
-        print(0)
-
-        if mode == "complete":
-            model, best_hps = train_lstm(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                          y_val.reshape(-1, 1), hps, hpo, mode)
-            preds_proba = model.predict([X_test_seq, X_test_stat])
-            results['preds'] = [int(round(pred[0])) for pred in preds_proba]
-            results['preds_proba'] = [pred_proba[0] for pred_proba in preds_proba]
-
-        elif mode == "static":
-            model, best_hps = train_lstm(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                          y_val.reshape(-1, 1), hps, hpo, mode)
-            preds_proba = model.predict([X_test_stat])
-            results['preds'] = [int(round(pred[0])) for pred in preds_proba]
-            results['preds_proba'] = [pred_proba[0] for pred_proba in preds_proba]
-
-        elif mode == "sequential":
-            model, best_hps = train_lstm(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                          y_val.reshape(-1, 1), hps, hpo, mode)
-            preds_proba = model.predict([X_test_seq])
-            results['preds'] = [int(round(pred[0])) for pred in preds_proba]
-            results['preds_proba'] = [pred_proba[0] for pred_proba in preds_proba]
-
-        elif mode == "rf":
-            model, best_hps = train_rf(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                        y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-        elif mode == "lr":
-            model, best_hps = train_lr(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                        y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-        elif mode == "gb":
-            model, best_hps = train_gb(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                        y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-        elif mode == "ada":
-            model, best_hps = train_ada(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                         y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-        elif mode == "nb":
-            model, best_hps = train_nb(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                        y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-
-        elif mode == "knn":
-            model, best_hps = train_knn(X_train_seq, X_train_stat, y_train.reshape(-1, 1), X_val_seq, X_val_stat,
-                                         y_val.reshape(-1, 1), hps, hpo)
-            preds_proba = model.predict_proba(concatenate_tensor_matrix(X_test_seq, X_test_stat))
-            results['preds'] = [np.argmax(pred_proba) for pred_proba in preds_proba]
-            results['preds_proba'] = [pred_proba[1] for pred_proba in preds_proba]
-
-        results['gts'] = [int(y) for y in y_test]
-        results['ts'] = ts
-
-        results_temp = pd.DataFrame(
-            list(zip(results['ts'],
-                     results['preds'],
-                     results['preds_proba'],
-                     results['gts'])),
-            columns=['ts', 'preds', 'preds_proba', 'gts'])
-
-        cut_lengths = range(0, max_len - 1)
-
-        # Init
-        if cut_lengths[0] not in results:
-            for cut_len in cut_lengths:
-                results[cut_len] = {}
-                results[cut_len]['acc'] = list()
-                results[cut_len]['auc'] = list()
-                results['all'] = {}
-                results['all']['rep'] = list()
-                results['all']['auc'] = list()
-
-        # Metrics per cut
-        for cut_len in cut_lengths:
-            results_temp_cut = results_temp[results_temp.ts == cut_len]
-
-            if not results_temp_cut.empty:  # if cut length is longer than max trace length
-                results[cut_len]['acc'].append(
-                    metrics.accuracy_score(y_true=results_temp_cut['gts'], y_pred=results_temp_cut['preds']))
-                try:
-                    results[cut_len]['auc'].append(
-                        metrics.roc_auc_score(y_true=results_temp_cut['gts'], y_score=results_temp_cut['preds_proba']))
-                except:
-                    pass
+            X_train_seq, X_train_stat, y_train = time_step_blow_up(
+                x_seqs[0: int(train_size * (1 - val_size) * len(y))],
+                x_statics[0: int(train_size * (1 - val_size) * len(y))],
+                y[0: int(train_size * (1 - val_size) * len(y))],
+                max_len,
+                ts_info=False,
+                x_time=time_start_val,
+                x_time_vals=x_time_train,
+                x_statics_vals_corr=None,
+                memmap_path=memmap_paths['train'],
+                ragged=ragged)
+
+            X_val_seq, X_val_stat, y_val = time_step_blow_up(
+                x_seqs[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+                x_statics[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+                y[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+                max_len,
+                ts_info=False,
+                x_time=time_start_test,
+                x_time_vals=x_time_val,
+                x_statics_vals_corr=None,
+                memmap_path=memmap_paths['val'],
+                ragged=ragged)
+
+    # No timestamp exists
+    else:
+        X_train_seq, X_train_stat, y_train = time_step_blow_up(x_seqs[0: int(train_size * (1 - val_size) * len(y))],
+                                                               x_statics[
+                                                               0: int(train_size * (1 - val_size) * len(y))],
+                                                               y[0: int(train_size * (1 - val_size) * len(y))],
+                                                               max_len,
+                                                               memmap_path=memmap_paths['train'],
+                                                               ragged=ragged)
+
+        X_val_seq, X_val_stat, y_val = time_step_blow_up(
+            x_seqs[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+            x_statics[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+            y[int(train_size * (1 - val_size) * len(y)): int(train_size * len(y))],
+            max_len,
+            memmap_path=memmap_paths['val'],
+            ragged=ragged)
+
+    if x_statics_vals_corr is not None:
+        X_test_seq, X_test_stat, y_test, ts = time_step_blow_up(x_seqs[int(train_size * len(y)):],
+                                                                x_statics[int(train_size * len(y)):],
+                                                                y[int(train_size * len(y)):],
+                                                                max_len,
+                                                                ts_info=True,
+                                                                x_statics_vals_corr=x_statics_vals_corr[int(train_size * len(y)):],
+                                                                memmap_path=memmap_paths['test'],
+                                                                ragged=ragged)
+    else:
+        X_test_seq, X_test_stat, y_test, ts = time_step_blow_up(x_seqs[int(train_size * len(y)):],
+                                                                x_statics[int(train_size * len(y)):],
+                                                                y[int(train_size * len(y)):],
+                                                                max_len,
+                                                                ts_info=True,
+                                                                x_statics_vals_corr=None,
+                                                                memmap_path=memmap_paths['test'],
+                                                                ragged=ragged)
+
+    print(0)
+
+    # Repetitions, the prefix tensors are shared (joblib memory-maps large arrays for the worker processes)
+    if seed is False:
+        seeds = np.random.randint(0, 2 ** 31 - 1, num_repetitions).tolist()
+    else:
+        seeds = [seed + repetition for repetition in range(0, num_repetitions)]
+    return_weights = n_jobs_repetitions != 1 and mode in ["complete", "static", "sequential"]
+
+    repetitions = joblib.Parallel(n_jobs=n_jobs_repetitions)(
+        joblib.delayed(run_repetition)(repetition_seed, mode, hps, hpo, X_train_seq, X_train_stat, y_train, X_val_seq,
+                                       X_val_stat, y_val, X_test_seq, X_test_stat, y_test, return_weights,
+                                       get_settings() if n_jobs_repetitions != 1 else None)
+        for repetition_seed in seeds)
+
+    results['gts'] = [int(y) for y in y_test]
+    results['ts'] = ts
+    best_model = None
+
+    for repetition, (model, best_hps, results['preds'], results['preds_proba']) in enumerate(repetitions):
+
+        # Metrics per prefix length, cut lengths without prefixes have no row
+        metrics_prefix_len = evaluation.get_prefix_length_metrics(results['ts'], results['gts'], results['preds'],
+                                                                  results['preds_proba'])
+        metrics_prefix_len = metrics_prefix_len[metrics_prefix_len['prefix_len'] < max_len - 1]
+        metrics_prefix_len.insert(0, 'repetition', repetition)
+        metrics_prefix_len.insert(1, 'seed', seeds[repetition])
+        metrics_repetitions.append(metrics_prefix_len)
 
         # Metrics across cuts
         results['all']['rep'].append(
-            metrics.classification_report(y_true=results_temp['gts'], y_pred=results_temp['preds'], output_dict=True))
+            metrics.classification_report(y_true=results['gts'], y_pred=results['preds'], output_dict=True))
 
         try:
-            auc = metrics.roc_auc_score(y_true=results_temp['gts'], y_score=results_temp['preds_proba'])
+            auc = metrics.roc_auc_score(y_true=results['gts'], y_score=results['preds_proba'])
             results['all']['auc'].append(auc)
 
             if auc >= max(results['all']['auc']):
                 best_hps_repetitions = best_hps
+                best_model = model
 
         except:
             pass
 
+    if return_weights and best_model is not None:
+        best_model = get_lstm_model(best_model, best_hps_repetitions, mode, X_train_seq, X_train_stat)
+    register_model(data_set, mode, target_activity, best_model, best_hps_repetitions)
+
+    if save_artifacts and best_model is not None and scalers is not None:
+        if seq_features is None or static_features is None:
+            seq_features, static_features = data.get_sepsis_features()
+        static_baseline = None  # static attributions at serving time (see artifacts.explain_static)
+        if mode in ["complete", "static"]:
+            static_baseline = (X_train_seq['statics'][X_train_seq['index'][:, 0]] if ragged else X_train_stat).mean(0)
+        artifacts.save_model_artifact(
+            artifact_root, f'{data_set}_{mode}_{target_activity}', best_model, mode, scalers, seq_features,
+            static_features, best_hps_repetitions, max_len, masking=pipeline == "bucketed" and ragged,
+            matrix_format="float32" if mode == "nb" and matrix_format == "csr" else matrix_format,
+            static_baseline=static_baseline)
+
     # Save all results
-    f = open(f'../output/{data_set}_{mode}_{target_activity}_summary.txt', 'w')
-    results_ = results
-    del results_['preds'], results_['preds_proba'], results_['gts'], results_['ts']
-    f.write(str(results_))
-    f.close()
+    metrics_repetitions = pd.concat(metrics_repetitions, ignore_index=True)
+    if metrics_format == "parquet":
+        metrics_repetitions.to_parquet(f'../output/{data_set}_{mode}_{target_activity}_metrics.parquet', index=False)
+    else:
+        metrics_repetitions.to_csv(f'../output/{data_set}_{mode}_{target_activity}_metrics.csv', index=False)
 
     # print metrics
     metrics_ = ["auc", "precision", "recall", "f1-score", "support", "accuracy"]
@@ -1121,26 +915,31 @@ def evaluate(x_seqs, x_statics, y, mode, target_activity, data_set, hps, hpo, x_
                 except:
                     pass
 
-    return X_train_seq, X_train_stat, y_train, X_val_seq, X_val_stat, y_val, best_hps_repetitions
+    return X_train_seq, X_train_stat, y_train, X_val_seq, X_val_stat, y_val, best_hps_repetitions, best_model
 
 
-def run_coefficient(x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val, target_activity,
-                    static_features, best_hps_repetitions):
+def run_coefficient(target_activity, static_features, x_seqs_train=None, x_statics_train=None, y_train=None,
+                    x_seqs_val=None, x_statics_val=None, y_val=None, refit=False):
     """
-    Trains an ml model with lstm, writes the weights for the static attributes into a file and returns a ml model.
-    :param x_seqs_train: sequential trainings dataset
-    :param x_statics_train: static trainings dataset
-    :param y_train: target attribute trainings dataset
-    :param x_seqs_val: sequential validation dataset
-    :param x_statics_val: static validation dataset
-    :param y_val: target attribute validation dataset
+    Writes the weights for the static attributes of the best lstm model of evaluate (mode "complete") into a file and
+    returns the model.
     :param target_activity: target activity of the dataset
     :param static_features: list of the names of the static features
-    :param best_hps_repetitions: a dictionary with informations about the best hyperparameters for the model
+    :param x_seqs_train: sequential trainings dataset, only needed for refit
+    :param x_statics_train: static trainings dataset, only needed for refit
+    :param y_train: target attribute trainings dataset, only needed for refit
+    :param x_seqs_val: sequential validation dataset, only needed for refit
+    :param x_statics_val: static validation dataset, only needed for refit
+    :param y_val: target attribute validation dataset, only needed for refit
+    :param refit: if true, the registered model is trained further, starting from its weights
     :return: lstm trained ml model
     """
-    model = train_lstm(x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val, best_hps_repetitions,
-                       False, mode="complete")
+    model, best_hps_repetitions = get_registered_model(data_set, "complete", target_activity)
+    if refit:
+        model = train_lstm(x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val,
+                           best_hps_repetitions, False, mode="complete", init_weights=model.get_weights())
+        register_model(data_set, "complete", target_activity, model, best_hps_repetitions)
+
     output_weights = model.get_layer(name='output_layer').get_weights()[0].flatten()[2 * best_hps_repetitions['size']:]
     output_names = static_features
 
@@ -1172,39 +971,36 @@ hps = {
     "knn": {"n_neighbors": [3, 5, 10, 15]}
 }
 
-if data_set == "sepsis":
+if __name__ == '__main__':
+    if data_set == "sepsis":
 
-    for mode in ['complete']:  # 'complete', 'static', 'sequential', 'lr', 'rf', 'gb', 'ada', 'knn', 'nb'
-        for target_activity in ['Admission IC']:
+        target_activities = ['Admission IC']  # 'Admission IC', 'Admission NC', 'Return ER', 'Release A', ...
+        sepsis_data = data.get_sepsis_data_targets(target_activities, max_len, min_len)  # one pass over the event log
 
-            x_seqs, x_statics, y, x_time_vals_final, seq_features, static_features = data.get_sepsis_data(
-                target_activity, max_len, min_len)
+        for mode in ['complete']:  # 'complete', 'static', 'sequential', 'lr', 'rf', 'gb', 'ada', 'knn', 'nb'
+            for target_activity in target_activities:
 
-            # Run eval on cuts to plot results --> Figure 1
-            x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val, best_hps_repetitions = evaluate(
-                x_seqs, x_statics, y, mode, target_activity,
-                data_set, hps, hpo, x_time=x_time_vals_final, x_statics_vals_corr=None)
+                x_seqs, x_statics, y, x_time_vals_final, seq_features, static_features, scalers = sepsis_data[
+                    target_activity]
 
-            if mode == "complete":
-                # Train model and plot linear coef
-                model = run_coefficient(x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val,
-                                        target_activity, static_features, best_hps_repetitions)
+                # Run eval on cuts to plot results --> Figure 1
+                x_seqs_train, x_statics_train, y_train, x_seqs_val, x_statics_val, y_val, best_hps_repetitions, model = evaluate(
+                    x_seqs, x_statics, y, mode, target_activity,
+                    data_set, hps, hpo, x_time=x_time_vals_final, x_statics_vals_corr=None, scalers=scalers,
+                    seq_features=seq_features, static_features=static_features)
 
-                x_seqs_train = x_seqs_train[0:1000]
-                x_statics_train = x_statics_train[0:1000]
+                if mode == "complete":
+                    # Plot linear coef of the best model of evaluate
+                    run_coefficient(target_activity, static_features)
 
-                # Get Explanations for LSTM inputs
-                explainer = shap.DeepExplainer(model, [x_seqs_train, x_statics_train])
-                shap_values = explainer.shap_values([x_seqs_train, x_statics_train])
+                    # Get Explanations for LSTM inputs of all training prefixes, in chunks across worker processes
+                    if pipeline == "sparse":  # shap needs the one-hot input, the weights are the same
+                        model = lstm.get_dense_model(model, mode, best_hps_repetitions,
+                                                     *lstm.get_input_shape(x_seqs_train, x_statics_train, max_len))
+                    attribution.explain(model, mode, x_seqs_train, x_statics_train, y_train,
+                                        f'../output/{data_set}_{mode}_{target_activity}_shap', max_len, shap_background,
+                                        shap_background_size, shap_chunk_size, n_jobs_shap, shap_max_prefixes,
+                                        shap_static)
 
-                seqs_df = pd.DataFrame(data=x_seqs_train.reshape(-1, len(seq_features)),
-                                       columns=seq_features)
-                seq_shaps = pd.DataFrame(data=shap_values[0][0].reshape(-1, len(seq_features)),
-                                         columns=[f'SHAP {x}' for x in seq_features])
-                seq_value_shape = pd.concat([seqs_df, seq_shaps], axis=1)
-
-                with open(f'../output/{data_set}_{mode}_{target_activity}_shap.npy', 'wb') as f:
-                    pickle.dump(seq_value_shape, f)
-
-else:
-    print("Data set not available!")
+    else:
+        print("Data set not available!")
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+
+prefix_tensor_names = ['X_seq', 'X_stat', 'y', 'ts']
+chunk_size = 4096  # number of prefixes padded at once when filling memory-mapped tensors
+
+
+def create_prefix_store(X_seq, X_stat, y, min_size_prefix, x_time_vals=None, max_time=None):
+    """
+    Creates a ragged representation of all prefixes of a list of cases.
+    Every event is stored once, a prefix is only a (trace_id, prefix_len) entry of the index.
+    :param X_seq: sequential feature dataset, list of cases (events x features)
+    :param X_stat: static feature dataset, list of arrays
+    :param y: target attribute, one entry per case
+    :param min_size_prefix: minimal length of a prefix
+    :param x_time_vals: by default none. a list of time stamps for every sequence in X_seq
+    :param max_time: by default none. if set (int64 nanoseconds), only prefixes whose last event is not later are
+        created. needs x_time_vals, the time stamps of a case have to be sorted
+    :return: dictionary
+        events : all events of all cases, one row per event
+        offsets : start of each case in events, the last entry is the number of events
+        statics : values of the static features, one row per case
+        y : target attribute, one entry per case
+        index : (number of prefixes x 2) array of (trace_id, prefix_len), ordered by case and length
+        times : timestamps of the events as int64 nanoseconds (only if x_time_vals is given)
+    """
+    if max_time is not None and x_time_vals is None:
+        raise ValueError('max_time requires x_time_vals')
+
+    lengths = np.array([len(x) for x in X_seq], dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(lengths)]
+
+    if x_time_vals is not None:
+        times = np.concatenate([np.asarray(x, dtype='datetime64[ns]').view('int64') for x in x_time_vals])
+
+    # Length of the longest prefix of every case, the cutoff is searched in the sorted time stamps of the case
+    prefix_lengths = lengths
+    if max_time is not None:
+        prefix_lengths = np.array([np.searchsorted(times[start:end], max_time, side='right')
+                                   for start, end in zip(offsets[:-1], offsets[1:])], dtype=np.int64)
+
+    num_prefixes = np.maximum(prefix_lengths - min_size_prefix + 1, 0)
+    trace_ids = np.repeat(np.arange(len(lengths)), num_prefixes)
+    prefix_lens = np.arange(num_prefixes.sum()) - np.repeat(np.cumsum(num_prefixes) - num_prefixes,
+                                                            num_prefixes) + min_size_prefix
+
+    store = {'events': np.concatenate([np.asarray(x, dtype=np.float32) for x in X_seq]),
+             'offsets': offsets,
+             'statics': np.array(X_stat, dtype=np.float64),
+             'y': np.asarray(y),
+             'index': np.stack([trace_ids, prefix_lens], axis=1)}
+
+    if x_time_vals is not None:
+        store['times'] = times
+
+    return store
+
+
+def get_prefix_end_times(store):
+    """
+    Returns the timestamp of the last event of every prefix of a prefix store.
+    :param store: prefix store created by create_prefix_store with x_time_vals
+    :return: array of int64 nanoseconds, one entry per prefix
+    """
+    trace_ids, prefix_lens = store['index'][:, 0], store['index'][:, 1]
+
+    return store['times'][store['offsets'][trace_ids] + prefix_lens - 1]
+
+
+def get_prefix_subset(store, rows):
+    """
+    Selects prefixes of a prefix store without copying its events.
+    :param store: prefix store created by create_prefix_store
+    :param rows: index selecting prefixes of store['index']
+    :return: prefix store containing only the selected prefixes
+    """
+    return dict(store, index=store['index'][rows])
+
+
+def get_prefix_positions(store, rows):
+    """
+    Locates the events of the selected prefixes of a prefix store, ordered by prefix and time step.
+    :param store: prefix store created by create_prefix_store
+    :param rows: index or slice selecting prefixes of store['index']
+    :return: four arrays:
+        trace_ids : case of every selected prefix
+        prefix_pos : position of the prefix within the selection, one entry per event of a prefix
+        time_step : time step of the event within its prefix
+        event_rows : row of the event in store['events']
+    """
+    trace_ids, prefix_lens = store['index'][rows, 0], store['index'][rows, 1]
+
+    prefix_pos = np.repeat(np.arange(len(trace_ids)), prefix_lens)
+    time_step = np.arange(prefix_lens.sum()) - np.repeat(np.cumsum(prefix_lens) - prefix_lens, prefix_lens)
+    event_rows = store['offsets'][trace_ids][prefix_pos] + time_step
+
+    return trace_ids, prefix_pos, time_step, event_rows
+
+
+def get_prefix_batch(store, rows, max_len):
+    """
+    Pads the selected prefixes of a prefix store to dense arrays.
+    :param store: prefix store created by create_prefix_store
+    :param rows: index or slice selecting prefixes of store['index']
+    :param max_len: length of the second dimension of the sequential array
+    :return: three arrays:
+        X_seq : (number of prefixes x max_len x number of features) zero-padded prefixes
+        X_stat : (number of prefixes x number of static features) static features of the prefixes
+        y : target attribute of the prefixes
+    """
+    trace_ids, prefix_pos, time_step, event_rows = get_prefix_positions(store, rows)
+
+    X_seq = np.zeros((len(trace_ids), max_len, store['events'].shape[1]), dtype=np.float32)
+    X_seq[prefix_pos, time_step] = store['events'][event_rows]
+
+    return X_seq, store['statics'][trace_ids], store['y'][trace_ids].astype(np.int32)
+
+
+def get_index_value_batch(store, rows, max_len):
+    """
+    Encodes the selected prefixes of a prefix store by the column and the value of the single non-zero feature of every
+    time step, instead of padding all features (see get_prefix_batch).
+    :param store: prefix store created by create_prefix_store. every event has at most one non-zero feature
+    :param rows: index or slice selecting prefixes of store['index']
+    :param max_len: length of the second dimension of the sequential arrays
+    :return: four arrays:
+        X_index : (number of prefixes x max_len) int8 column of the non-zero feature, 0 for padded time steps
+        X_value : (number of prefixes x max_len) float32 value of the non-zero feature, 0 for padded time steps
+        X_stat : (number of prefixes x number of static features) static features of the prefixes
+        y : target attribute of the prefixes
+    """
+    events = store['events']
+    if (np.count_nonzero(events, axis=1) > 1).any():
+        raise ValueError('Events with more than one non-zero feature cannot be index-value encoded')
+    event_index = np.abs(events).argmax(axis=1).astype(np.int8)
+    event_value = events[np.arange(len(events)), event_index]
+
+    trace_ids, prefix_pos, time_step, event_rows = get_prefix_positions(store, rows)
+
+    X_index = np.zeros((len(trace_ids), max_len), dtype=np.int8)
+    X_value = np.zeros((len(trace_ids), max_len), dtype=np.float32)
+    X_index[prefix_pos, time_step] = event_index[event_rows]
+    X_value[prefix_pos, time_step] = event_value[event_rows]
+
+    return X_index, X_value, store['statics'][trace_ids], store['y'][trace_ids].astype(np.int32)
+
+
+def get_prefix_store_path(path, params):
+    """
+    Returns the directory of memory-mapped prefix tensors keyed on the data they are created from.
+    :param path: path prefix of the directory, e.g. '../output/prefixes/sepsis_Admission IC_train'
+    :param params: list of arrays and parameters the prefix tensors are created from
+    :return: path of the directory
+    """
+    key = hashlib.sha1()
+    for param in params:
+        if isinstance(param, (list, tuple)):
+            for x in param:
+                x = np.ascontiguousarray(x)
+                key.update(repr((x.shape, x.dtype.str)).encode())  # equal bytes of differently shaped arrays
+                key.update(x.tobytes())
+        else:
+            key.update(repr(param).encode())
+
+    return f'{path}_{key.hexdigest()[:16]}'
+
+
+def create_prefix_tensors(path, num_prefixes, max_len, num_features_seq, num_features_stat):
+    """
+    Allocates memory-mapped prefix tensors in a temporary directory next to path.
+    The tensors are written to disk by the operating system while they are filled, so they never have to fit into memory.
+    :param path: directory of the prefix tensors
+    :param num_prefixes: number of prefixes
+    :param max_len: length of the second dimension of the sequential tensor
+    :param num_features_seq: number of sequential features
+    :param num_features_stat: number of static features
+    :return: four zero-initialized memory-mapped arrays (X_seq, X_stat, y, ts)
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    shapes = [(num_prefixes, max_len, num_features_seq), (num_prefixes, num_features_stat), (num_prefixes,),
+              (num_prefixes,)]
+    dtypes = [np.float32, np.float64, np.int32, np.int64]
+
+    return [np.lib.format.open_memmap(os.path.join(tmp_path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+            for name, dtype, shape in zip(prefix_tensor_names, dtypes, shapes)]
+
+
+def save_prefix_tensors(path, tensors):
+    """
+    Flushes memory-mapped prefix tensors created by create_prefix_tensors and publishes their directory.
+    :param path: directory of the prefix tensors
+    :param tensors: memory-mapped arrays returned by create_prefix_tensors
+    """
+    for tensor in tensors:
+        tensor.flush()
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(path + '.tmp', path)  # no half-written tensors if the run is interrupted
+
+
+def load_prefix_tensors(path):
+    """
+    Opens prefix tensors written by save_prefix_tensors without copying them into memory.
+    :param path: directory of the prefix tensors
+    :return: four read-only memory-mapped arrays (X_seq, X_stat, y, ts) or none, if the tensors do not exist
+    """
+    if not os.path.isdir(path):
+        return None
+
+    return [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in prefix_tensor_names]
@@ -0,0 +1,224 @@
+import concurrent.futures
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+import src.data as data
+import src.util as util
+
+tf = util.lazy_import('tensorflow')
+lstm = util.lazy_import('src.lstm')
+
+
+class PredictionService:
+    """
+    Serves the predictions of a trained lstm model for partial patient pathways.
+    Requests of concurrent clients are collected by a background thread and predicted in micro-batches, one
+    model.predict call per batch.
+    """
+
+    def __init__(self, model, seq_features, static_features, scalers, max_len, mode="complete", max_batch_size=64,
+                 max_delay=0.005):
+        """
+        :param model: trained model with one-hot sequential input (see lstm.build_model and lstm.get_dense_model)
+        :param seq_features: list of sequence features the model was trained on
+        :param static_features: list of static features the model was trained on
+        :param scalers: dictionary of normalization constants of the training data (see data.fit_sepsis_scalers)
+        :param max_len: number of time steps of the sequential input
+        :param mode: architecture of the model (see lstm.get_inputs)
+        :param max_batch_size: maximal number of requests predicted at once
+        :param max_delay: maximal time in seconds the first request of a batch waits for further requests
+        """
+        self.model = model
+        self.seq_features = seq_features
+        self.static_features = static_features
+        self.scalers = scalers
+        self.max_len = max_len
+        self.mode = mode
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        # the model lives in the graph and session of the creating thread
+        self.graph = tf.compat.v1.get_default_graph()
+        self.session = tf.compat.v1.keras.backend.get_session()
+
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def submit(self, pathway):
+        """
+        Queues a partial patient pathway for prediction.
+        :param pathway: dictionary
+            activities : list of the activities of the events so far
+            leucocytes : list of the leucocytes values of the events (nan if not measured)
+            crp : list of the crp values of the events (nan if not measured)
+            lacticacid : list of the lacticacid values of the events (nan if not measured)
+            statics : dictionary of the values of the static features
+        :return: future of the predicted probability of the target activity
+        """
+        if not self.thread.is_alive():
+            raise RuntimeError('The prediction service is closed')
+
+        future = concurrent.futures.Future()
+        self.requests.put((pathway, future))
+
+        return future
+
+    def predict(self, pathway, timeout=10.):
+        """
+        :param pathway: partial patient pathway (see submit)
+        :param timeout: maximal time in seconds to wait for the prediction, none: no limit
+        :return: predicted probability of the target activity
+        """
+        return self.submit(pathway).result(timeout)
+
+    def close(self):
+        """
+        Stops the background thread after the queued requests are predicted.
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+    def serve(self):
+        """
+        Collects requests into batches until close is called.
+        """
+        closed = False
+        while not closed:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            batch = [request]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closed = True
+                    break
+                batch.append(request)
+
+            try:
+                self.predict_batch(batch)
+            except Exception as e:  # the thread keeps serving the next batches
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def predict_batch(self, batch):
+        """
+        Encodes the pathways of a batch of requests and answers them with one prediction of the model.
+        :param batch: list of (pathway, future) tuples
+        """
+        valid_batch = []
+        for pathway, future in batch:
+            try:  # a malformed request only fails its own future
+                validate_pathway(pathway, self.seq_features, self.static_features, self.max_len)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                valid_batch.append((pathway, future))
+
+        if not valid_batch:
+            return
+
+        try:
+            x_seq, x_stat = encode_pathways([pathway for pathway, _ in valid_batch], self.seq_features,
+                                            self.static_features, self.scalers, self.max_len)
+            with self.graph.as_default(), self.session.as_default():
+                preds_proba = self.model.predict(lstm.get_inputs(x_seq, x_stat, self.mode))[:, 0]
+        except Exception as e:
+            for _, future in valid_batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), pred_proba in zip(valid_batch, preds_proba):
+            future.set_result(float(pred_proba))
+
+
+def validate_pathway(pathway, seq_features, static_features, max_len):
+    """
+    Checks a partial patient pathway before it is encoded.
+    :param pathway: partial patient pathway (see PredictionService.submit)
+    :param seq_features: list of sequence features
+    :param static_features: list of static features
+    :param max_len: maximal number of events
+    """
+    if not isinstance(pathway, dict):
+        raise TypeError(f'Pathways are dictionaries, not {type(pathway).__name__}')
+    missing_keys = {'activities', 'leucocytes', 'crp', 'lacticacid', 'statics'} - set(pathway)
+    if missing_keys:
+        raise ValueError(f'Missing keys: {missing_keys}')
+
+    unknown_activities = set(pathway['activities']) - set(seq_features)
+    if unknown_activities:
+        raise ValueError(f'Unknown activities: {unknown_activities}')
+    if not 0 < len(pathway['activities']) <= max_len:
+        raise ValueError(f'Pathways need 1 to {max_len} events')
+    if any(len(pathway[key]) != len(pathway['activities']) for key in ['leucocytes', 'crp', 'lacticacid']):
+        raise ValueError('Pathways need one leucocytes, crp and lacticacid value per event')
+    missing_statics = set(static_features) - set(pathway['statics'])
+    if missing_statics:
+        raise ValueError(f'Missing static features: {missing_statics}')
+
+
+def encode_pathways(pathways, seq_features, static_features, scalers, max_len):
+    """
+    Encodes partial patient pathways like the cases of the training data (see data.create_sepsis_cases).
+    :param pathways: list of partial patient pathways (see PredictionService.submit)
+    :param seq_features: list of sequence features
+    :param static_features: list of static features
+    :param scalers: dictionary of normalization constants
+    :param max_len: number of time steps of the sequential array
+    :return: zero-padded sequential array (number of pathways x max_len x number of seq_features) and static array
+    """
+    lengths = np.array([len(pathway['activities']) for pathway in pathways])
+
+    events = util.get_one_hot_of_activities_sepsis(
+        np.concatenate([pathway['activities'] for pathway in pathways]),
+        np.concatenate([pathway['leucocytes'] for pathway in pathways]),
+        np.concatenate([pathway['crp'] for pathway in pathways]),
+        np.concatenate([pathway['lacticacid'] for pathway in pathways]),
+        seq_features, scalers['max_leucocytes'], scalers['max_lacticacid'])
+
+    x_seq = np.zeros((len(pathways), max_len, len(seq_features)), dtype=np.float32)
+    pathway_pos = np.repeat(np.arange(len(pathways)), lengths)
+    time_step = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    x_seq[pathway_pos, time_step] = events
+
+    df_statics = pd.DataFrame([pathway['statics'] for pathway in pathways], columns=static_features)
+    x_stat = data.apply_sepsis_scalers(df_statics, scalers).values.astype(float)
+
+    return x_seq, x_stat
+
+
+def run_load_test(service, pathways, num_clients=8, num_requests=1000):
+    """
+    Sends requests of concurrent clients to a prediction service and measures their latency.
+    :param service: prediction service
+    :param pathways: list of partial patient pathways, the requests cycle through them
+    :param num_clients: number of client threads sending one request after another
+    :param num_requests: total number of requests
+    :return: dictionary
+        p50 : median latency in milliseconds
+        p99 : 99th percentile of the latency in milliseconds
+        throughput : answered requests per second
+    """
+    def send(idx):
+        start = time.perf_counter()
+        service.predict(pathways[idx % len(pathways)])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_clients) as executor:
+        latencies = np.array(list(executor.map(send, range(num_requests))))
+    duration = time.perf_counter() - start
+
+    return {'p50': np.percentile(latencies, 50) * 1000,
+            'p99': np.percentile(latencies, 99) * 1000,
+            'throughput': num_requests / duration}
@@ -5,14 +5,16 @@ import matplotlib
 import itertools
 import seaborn as sns
 import numpy as np
-import pickle
+import src.attribution as attribution
+import src.data as data
 
 data_set = "sepsis"
 mode = "complete"
 target_activity = "Admission IC"
 
 
-with open(f'../output/{data_set}_{mode}_{target_activity}_shap.npy', 'rb') as f: X_all = pickle.load(f)
+X_all = attribution.load_attributions(f'../output/{data_set}_{mode}_{target_activity}_shap',
+                                     data.get_sepsis_features()[0])
 
 
 matplotlib.style.use('default')
@@ -0,0 +1,130 @@
+import collections
+import time
+import numpy as np
+import src.kernels as kernels
+import src.serving as serving
+import src.util as util
+
+tf = util.lazy_import('tensorflow')
+
+
+class StreamingScorer:
+    """
+    Scores running cases event by event with the weights of a trained lstm model (mode "complete" or "sequential").
+    The model has to be built with masking (see lstm.build_model), so the padded time steps do not change its states.
+    The forward state of every open case is advanced by one time step per incoming event, O(1) per event. The backward
+    direction of the bidirectional lstm reads the prefix from its newest event on and is re-run over the L events of
+    the case, so scoring an event still costs O(L) backward steps, but not the max_len steps of the padded prefix.
+    Open cases are evicted when they are closed, idle for longer than max_idle or the least recently updated of more
+    than max_cases cases.
+    """
+
+    def __init__(self, model, seq_features, static_features, scalers, max_len, mode="complete", max_cases=10000,
+                 max_idle=24 * 3600):
+        """
+        :param model: trained model with one-hot sequential input and masking (see lstm.build_model and
+            lstm.get_dense_model)
+        :param seq_features: list of sequence features the model was trained on
+        :param static_features: list of static features the model was trained on
+        :param scalers: dictionary of normalization constants of the training data (see data.fit_sepsis_scalers)
+        :param max_len: number of time steps of the sequential input
+        :param mode: architecture of the model, "complete" or "sequential"
+        :param max_cases: maximal number of open cases
+        :param max_idle: time in seconds after which a case without new events is evicted
+        """
+        if mode not in ["complete", "sequential"]:
+            raise ValueError(f'Streaming scores need a sequential input, not mode {mode}')
+        # without masking, every score would run the forward direction over the max_len - L trailing padding steps
+        if not any(isinstance(layer, tf.keras.layers.Masking) for layer in model.layers):
+            raise ValueError('Streaming scores need a model built with masking (pipeline "bucketed")')
+
+        self.seq_features = seq_features
+        self.static_features = static_features
+        self.scalers = scalers
+        self.max_len = max_len
+        self.mode = mode
+        self.max_cases = max_cases
+        self.max_idle = max_idle
+
+        lstm_layer = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Bidirectional)][0]
+        weights = [w.astype(np.float64) for w in lstm_layer.get_weights()]
+        self.forward_weights, self.backward_weights = weights[:3], weights[3:]
+        self.output_kernel, self.output_bias = model.get_layer(name='output_layer').get_weights()
+        self.units = self.forward_weights[1].shape[0]
+
+        self.cases = collections.OrderedDict()
+
+    def add_event(self, case_id, activity, leucocytes=np.nan, crp=np.nan, lacticacid=np.nan, statics=None, now=None):
+        """
+        Adds the next event of a case and scores the case.
+        :param case_id: id of the case
+        :param activity: activity of the event
+        :param leucocytes: leucocytes value of the event (nan if not measured)
+        :param crp: crp value of the event (nan if not measured)
+        :param lacticacid: lacticacid value of the event (nan if not measured)
+        :param statics: dictionary of the values of the static features, needed for the first event of a case
+            (ER Registration)
+        :param now: time of the event in seconds, by default the time of the call
+        :return: predicted probability of the target activity
+        """
+        now = time.monotonic() if now is None else now
+        self.evict_idle(now)
+
+        case = self.cases.get(case_id)
+        if case is None:
+            if statics is None:
+                raise ValueError(f'The first event of case {case_id} needs the static features')
+            _, x_stat = serving.encode_pathways([{'activities': [], 'leucocytes': [], 'crp': [], 'lacticacid': [],
+                                                  'statics': statics}], self.seq_features, self.static_features,
+                                                self.scalers, 0)
+            case = {'h': np.zeros(self.units), 'c': np.zeros(self.units), 'events': [], 'statics': x_stat[0]}
+
+        if len(case['events']) == self.max_len:
+            raise ValueError(f'Case {case_id} is longer than {self.max_len} events')
+        if activity not in self.seq_features:
+            raise ValueError(f'Unknown activity: {activity}')
+
+        x_seq, _ = serving.encode_pathways([{'activities': [activity], 'leucocytes': [leucocytes], 'crp': [crp],
+                                             'lacticacid': [lacticacid], 'statics': {}}], self.seq_features,
+                                           self.static_features, self.scalers, 1)
+        event = x_seq[0, 0].astype(np.float64)
+
+        # the case is only stored once its event is encoded, a failing event leaves no half-built state
+        case['h'], case['c'] = kernels.lstm_step(event, case['h'], case['c'], *self.forward_weights)
+        case['events'].append(event)
+        case['last_seen'] = now
+        self.cases[case_id] = case
+        self.cases.move_to_end(case_id)
+        if len(self.cases) > self.max_cases:
+            self.cases.popitem(last=False)  # least recently updated case
+
+        return self.score(case)
+
+    def score(self, case):
+        """
+        Runs the backward direction over the L events of the case, the forward state is already advanced.
+        :param case: state of an open case
+        :return: predicted probability of the target activity for the events of the case so far
+        """
+        h_backward, c_backward = np.zeros(self.units), np.zeros(self.units)
+        for event in reversed(case['events']):
+            h_backward, c_backward = kernels.lstm_step(event, h_backward, c_backward, *self.backward_weights)
+
+        outputs = [case['h'], h_backward] + ([case['statics']] if self.mode == "complete" else [])
+
+        return float(kernels.sigmoid(np.concatenate(outputs) @ self.output_kernel[:, 0] + self.output_bias[0]))
+
+    def close_case(self, case_id):
+        """
+        Removes the state of a finished case.
+        :param case_id: id of the case
+        """
+        self.cases.pop(case_id, None)
+
+    def evict_idle(self, now):
+        """
+        Removes the states of all cases without new events for longer than max_idle.
+        :param now: current time in seconds
+        """
+        while self.cases and now - next(iter(self.cases.values()))['last_seen'] > self.max_idle:
+            self.cases.popitem(last=False)
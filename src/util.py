@@ -1,53 +1,66 @@
+import importlib.util
+import sys
 import numpy as np
+import pandas as pd
 
-def get_one_hot_of_activity_sepsis(x, max_leucocytes, max_lacticacid):
+
+def get_one_hot_of_activities_sepsis(activities, leucocytes, crp, lacticacid, seq_features, max_leucocytes,
+                                     max_lacticacid):
     """
-    Creates a one-hot vector based on the ['Activity']-value of x.
-    :param x: dataset
+    Creates the one-hot matrix of a batch of events based on their activities.
+    Events of the activities 'Leucocytes', 'CRP' and 'LacticAcid' carry their (clipped) lab value instead of 1,
+    a missing lab value is coded as -1.
+    :param activities: array of activity names, one entry per event
+    :param leucocytes: array of leucocytes values, one entry per event
+    :param crp: array of crp values, one entry per event
+    :param lacticacid: array of lacticacid values, one entry per event
+    :param seq_features: list of sequence features, determines the column of each activity
     :param max_leucocytes: numerical value representing the maximal value of leucocytes
     :param max_lacticacid: numerical value representing the maximal value of lacticacid
-    :return: one-hot vector
+    :return: one-hot matrix (number of events x number of seq_features)
     """
-    if x['Activity'] == 'Leucocytes':
-        ret = [0, min(x['Leucocytes'], max_leucocytes) / max_leucocytes]
-        if np.isnan(ret[1]):
-            ret[1] = -1
-    elif x['Activity'] == 'CRP':
-        ret = [1, x['CRP']]
-        if np.isnan(ret[1]):
-            ret[1] = -1
-    elif x['Activity'] == 'LacticAcid':
-        ret = [2, min(x['LacticAcid'], max_lacticacid) / max_lacticacid]
-        if np.isnan(ret[1]):
-            ret[1] = -1
-    elif x['Activity'] == 'ER Registration':
-        ret = [3, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'ER Triage':
-        ret = [4, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'ER Sepsis Triage':
-        ret = [5, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'IV Liquid':
-        ret = [6, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'IV Antibiotics':
-        ret = [7, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Admission NC':
-        ret = [8, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Admission IC':
-        ret = [9, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Return ER':
-        ret = [10, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Release A':
-        ret = [11, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Release B':
-        ret = [12, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Release C':
-        ret = [13, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Release D':
-        ret = [14, 1]  # No additional information, so normal one hot
-    elif x['Activity'] == 'Release E':
-        ret = [15, 1]  # No additional information, so normal one hot
-
-    one_hot = np.zeros(16, dtype=np.float32)
-    one_hot[ret[0]] = ret[1]
+    act2int = pd.Index(seq_features)
+    idx = act2int.get_indexer(np.asarray(activities))
+    if (idx == -1).any():
+        raise ValueError(f'Unknown activities: {set(np.asarray(activities)[idx == -1])}')
+
+    values = np.ones(len(idx))
+
+    is_leucocytes = idx == act2int.get_loc('Leucocytes')
+    values[is_leucocytes] = np.minimum(np.asarray(leucocytes, dtype=float)[is_leucocytes],
+                                       max_leucocytes) / max_leucocytes
+    is_crp = idx == act2int.get_loc('CRP')
+    values[is_crp] = np.asarray(crp, dtype=float)[is_crp]
+    is_lacticacid = idx == act2int.get_loc('LacticAcid')
+    values[is_lacticacid] = np.minimum(np.asarray(lacticacid, dtype=float)[is_lacticacid],
+                                       max_lacticacid) / max_lacticacid
+    values[np.isnan(values)] = -1  # No lab value recorded
+
+    one_hot = np.zeros((len(idx), len(seq_features)), dtype=np.float32)
+    one_hot[np.arange(len(idx)), idx] = values
 
     return one_hot
+
+
+def lazy_import(name):
+    """
+    Imports a module on first attribute access, so heavy backends (tensorflow, shap) are only loaded by code paths
+    that use them.
+    :param name: name of the module, e.g. 'src.lstm'
+    :return: module, loaded on first use
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name}')
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    if '.' in name:  # like an import, bind the submodule to its package
+        parent, child = name.rsplit('.', 1)
+        setattr(sys.modules[parent], child, module)
+
+    return module
@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import src.data as data
+
+max_len = 8
+
+
+@pytest.fixture(scope='module')
+def lstm_model():
+    """
+    Untrained model of mode "complete" with masking, the layers named like in lstm.build_model. it is not compiled,
+    the tests only predict with its random weights.
+    :return: dictionary
+        model : keras model
+        seq_features : list of sequence features
+        static_features : list of static features
+        scalers : dictionary of normalization constants
+        max_len : number of time steps of the sequential input
+    """
+    pytest.importorskip('tensorflow')
+    import src.lstm as lstm
+    tf = lstm.tf
+
+    seq_features, static_features = data.get_sepsis_features()
+    input_layer_seq = tf.keras.layers.Input(shape=(None, len(seq_features)), name='seq_input_layer')
+    masking_layer = tf.keras.layers.Masking(mask_value=0.)(input_layer_seq)
+    hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(units=4, return_sequences=False))(masking_layer)
+    input_layer_static = tf.keras.layers.Input(shape=(len(static_features),), name='static_input_layer')
+    output_layer = tf.keras.layers.Dense(1, activation='sigmoid', name='output_layer')(
+        tf.keras.layers.concatenate([hidden_layer, input_layer_static]))
+
+    return {'model': tf.keras.models.Model(inputs=[input_layer_seq, input_layer_static], outputs=output_layer),
+            'seq_features': seq_features,
+            'static_features': static_features,
+            'scalers': {'max_age': 90., 'max_leucocytes': 25., 'max_lacticacid': 5.},
+            'max_len': max_len}
+
+
+@pytest.fixture(scope='module')
+def pathways():
+    """
+    :return: list of partial patient pathways (see serving.PredictionService.submit) of different lengths
+    """
+    _, static_features = data.get_sepsis_features()
+    activities = ['ER Registration', 'ER Triage', 'CRP', 'Leucocytes', 'ER Sepsis Triage', 'IV Liquid', 'LacticAcid',
+                  'IV Antibiotics']
+
+    return [{'activities': activities[:length],
+             'leucocytes': [12. if activity == 'Leucocytes' else np.nan for activity in activities[:length]],
+             'crp': [80. if activity == 'CRP' else np.nan for activity in activities[:length]],
+             'lacticacid': [2. if activity == 'LacticAcid' else np.nan for activity in activities[:length]],
+             'statics': {feature: 0.5 if feature == 'Age' else float(length % 2) for feature in static_features}}
+            for length in [1, 3, 5, 8]]
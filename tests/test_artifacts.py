@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pytest
+from sklearn import ensemble, linear_model
+import src.artifacts as artifacts
+import src.features as features
+import src.kernels as kernels
+import src.serving as serving
+
+scalers = {'max_age': 90., 'max_leucocytes': 25., 'max_lacticacid': 5.}
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    random_state = np.random.RandomState(0)
+    x_seq = (random_state.rand(100, 4, 3) > 0.7).astype(np.float32)
+    x_stat = random_state.rand(100, 2)
+    y = (x_seq[:, :, 0].sum(axis=1) + x_stat[:, 0] > 1.5).astype(int)
+
+    return x_seq, x_stat, y
+
+
+@pytest.mark.parametrize('mode, model, matrix_format', [
+    ("rf", ensemble.RandomForestClassifier(n_estimators=10, random_state=0), "dense"),
+    ("lr", linear_model.LogisticRegression(), "csr")])
+def test_sklearn_round_trip(tmp_path, dataset, mode, model, matrix_format):
+    x_seq, x_stat, y = dataset
+    model.fit(features.concatenate_tensor_matrix(x_seq, x_stat, matrix_format), y)
+
+    path = artifacts.save_model_artifact(str(tmp_path), 'model', model, mode, scalers, ['a', 'b', 'c'], ['d', 'e'],
+                                         {}, 4, matrix_format=matrix_format)
+    artifact = artifacts.load_model_artifact(str(tmp_path), 'model')
+
+    assert os.path.basename(path) == 'v0001'
+    assert artifact['scalers'] == scalers and artifact['max_len'] == 4
+    np.testing.assert_array_equal(artifacts.predict_proba(artifact, x_seq, x_stat),
+                                  model.predict_proba(features.concatenate_tensor_matrix(x_seq, x_stat,
+                                                                                        matrix_format))[:, 1])
+
+
+def test_lstm_round_trip(tmp_path, lstm_model, pathways):
+    model = lstm_model['model']
+    x_seq, x_stat = serving.encode_pathways(pathways, lstm_model['seq_features'], lstm_model['static_features'],
+                                            lstm_model['scalers'], lstm_model['max_len'])
+    baseline = x_stat.mean(axis=0)
+
+    artifacts.save_model_artifact(str(tmp_path), 'model', model, "complete", lstm_model['scalers'],
+                                  lstm_model['seq_features'], lstm_model['static_features'], {'size': 4},
+                                  lstm_model['max_len'], masking=True, static_baseline=baseline)
+    artifact = artifacts.load_model_artifact(str(tmp_path), 'model')
+
+    np.testing.assert_array_equal(artifacts.predict_proba(artifact, x_seq, x_stat),
+                                  kernels.predict_lstm(model.get_weights(), x_seq, x_stat, masking=True))
+    np.testing.assert_allclose(artifacts.predict_proba(artifact, x_seq, x_stat), model.predict([x_seq, x_stat])[:, 0],
+                               rtol=1e-5)
+    np.testing.assert_allclose(artifacts.explain_static(artifact, x_stat),
+                               kernels.get_static_attributions(model.get_weights(), x_stat, baseline))
+
+
+def test_latest_version_ignores_other_entries(tmp_path, dataset):
+    x_seq, x_stat, y = dataset
+    model = linear_model.LogisticRegression().fit(features.concatenate_tensor_matrix(x_seq, x_stat), y)
+    for _ in range(2):
+        artifacts.save_model_artifact(str(tmp_path), 'model', model, "lr", scalers, ['a', 'b', 'c'], ['d', 'e'], {}, 4)
+    os.makedirs(tmp_path / 'model' / 'v0003.tmp')  # interrupted save
+    os.makedirs(tmp_path / 'model' / 'latest')
+    (tmp_path / 'model' / '.DS_Store').write_text('')
+
+    assert os.path.basename(artifacts.get_artifact_path(str(tmp_path), 'model')) == 'v0002'
+    assert artifacts.load_model_artifact(str(tmp_path), 'model', 1)['version'] == 1
+    with pytest.raises(FileNotFoundError):
+        artifacts.load_model_artifact(str(tmp_path), 'missing')
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+import src.backtest as backtest
+import src.main as main
+import src.prefixes as prefixes
+
+day = 24 * 3600 * 10 ** 9
+
+
+@pytest.fixture(scope='module')
+def cases():
+    random_state = np.random.RandomState(0)
+    lengths = random_state.randint(2, 6, 120)
+    x_seqs = [(random_state.rand(length, 3) > 0.6).astype(np.float32) + np.eye(3, dtype=np.float32)[0]
+              for length in lengths]
+    x_statics = list(random_state.rand(120, 2))
+    y = [int(x_seq[:, 1].sum() + x_stat[0] > 1.5) for x_seq, x_stat in zip(x_seqs, x_statics)]
+    # case i starts on day i, its events follow every 6 hours
+    x_time = [pd.to_datetime(idx * day + np.arange(length) * day // 4) for idx, length in enumerate(lengths)]
+
+    return x_seqs, x_statics, y, x_time
+
+
+def test_windows_do_not_leak(cases):
+    store = prefixes.create_prefix_store(*cases[:3], 1, cases[3])
+    start_times = store['times'][store['offsets'][:-1]]
+    trace_ids = store['index'][:, 0]
+    end_times = prefixes.get_prefix_end_times(store)
+    cutoffs = backtest.get_cutoffs(start_times, 3, 0.5)
+
+    windows = backtest.get_windows(store, cutoffs, 0.2)
+
+    assert len(windows) == 3 and np.all(np.diff(cutoffs) > 0)
+    for window, end in zip(windows, np.r_[cutoffs[1:], np.iinfo(np.int64).max]):
+        val_start = start_times[trace_ids[window['val']]].min()
+        assert end_times[window['train']].max() <= val_start
+        assert end_times[window['val']].max() <= window['cutoff']
+        assert np.all((start_times[trace_ids[window['test']]] >= window['cutoff']) &
+                      (start_times[trace_ids[window['test']]] < end))
+        assert not set(trace_ids[window['train']]) & set(trace_ids[window['val']])
+        # all prefixes of the test cases are tested
+        assert len(window['test']) == np.isin(trace_ids, trace_ids[window['test']]).sum()
+
+
+def test_train_window_limits_the_training_cases(cases):
+    store = prefixes.create_prefix_store(*cases[:3], 1, cases[3])
+    start_times = store['times'][store['offsets'][:-1]]
+    cutoffs = backtest.get_cutoffs(start_times, 2, 0.5)
+
+    windows = backtest.get_windows(store, cutoffs, 0.2, train_window=30)
+
+    for window in windows:
+        train_starts = start_times[store['index'][window['train'], 0]]
+        assert train_starts.min() >= window['cutoff'] - 30 * day
+
+
+def test_run_backtest(monkeypatch, tmp_path, cases):
+    (tmp_path / 'output').mkdir()
+    (tmp_path / 'src').mkdir()
+    monkeypatch.chdir(tmp_path / 'src')  # the hpos are written to ../output
+    monkeypatch.setattr(main, 'max_len', 5)
+    monkeypatch.setattr(main, 'mode', main.mode)  # set by run_backtest
+    monkeypatch.setattr(main, 'target_activity', 'Admission IC', raising=False)
+    monkeypatch.setattr(main, 'hps', {"lr": {"reg_strength": [0.1, 1.], "solver": ["lbfgs"]}})
+    start_times = np.array([x_time[0].value for x_time in cases[3]])
+
+    results = backtest.run_backtest(*cases, "lr", backtest.get_cutoffs(start_times, 2, 0.5))
+
+    assert sorted(results['window'].unique()) == [0, 1]
+    for _, results_window in results.groupby('window'):
+        assert results_window['num_prefixes'].sum() == results_window['num_test'].iloc[0]
+        assert 0 <= results_window['auc_window'].iloc[0] <= 1
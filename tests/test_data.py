@@ -0,0 +1,53 @@
+"""
+Parity of the vectorized ingestion (data.get_sepsis_data) with the former loop over the cases.
+
+The golden fixtures in fixtures/ were written by the loop implementation of get_sepsis_data (baseline commit 62c68a6)
+with max_len=100 and min_len=3, one file per target activity in the ragged layout of data.cut_sepsis_cases.
+
+Events of a case sharing a timestamp have no defined order. The cases are cut before the first occurrence of the
+target activity, so the vectorized ingestion has to order them like the loop did to cut at the same event.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import src.data as data
+
+ds_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'Sepsis Cases - Event Log.csv')
+fixture_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'sepsis_{}.npz')
+target_activities = ['Admission IC', 'Admission NC', 'Return ER', 'Release A']
+max_len = 100
+min_len = 3
+
+
+def load_golden(target_activity):
+    """
+    :param target_activity: target activity of the fixture
+    :return: dictionary of arrays written by the loop implementation (see data.cut_sepsis_cases)
+    """
+    with np.load(fixture_path.format(target_activity.lower().replace(' ', '_'))) as f:
+        return {name: f[name] for name in f.files}
+
+
+@pytest.fixture(scope='module')
+def sepsis_data():
+    return data.get_sepsis_data_targets(target_activities, max_len, min_len, ds_path=ds_path, use_cache=False)
+
+
+@pytest.mark.parametrize('target_activity', target_activities)
+def test_parity_with_loop(sepsis_data, target_activity):
+    golden = load_golden(target_activity)
+    x_seqs, x_statics, y, x_time_vals, _, _, _ = sepsis_data[target_activity]
+    offsets = golden['offsets']
+
+    assert len(x_seqs) == len(offsets) - 1
+    assert y == golden['y'].tolist()
+    np.testing.assert_array_equal(np.asarray(x_statics), golden['statics'])
+
+    for case, (x_seq, x_time) in enumerate(zip(x_seqs, x_time_vals)):
+        rows = slice(offsets[case], offsets[case + 1])
+        np.testing.assert_array_equal(x_seq, golden['events'][rows])
+        np.testing.assert_array_equal(x_time.values.view('int64'), golden['times'][rows])
@@ -0,0 +1,77 @@
+import os
+import sys
+import numpy as np
+import pytest
+from sklearn import base, ensemble, linear_model
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import src.hpo as hpo
+
+ensembles = [ensemble.RandomForestClassifier(n_estimators=20, random_state=0),
+             ensemble.GradientBoostingClassifier(n_estimators=20, random_state=0),
+             ensemble.AdaBoostClassifier(n_estimators=20, random_state=0)]
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    random_state = np.random.RandomState(0)
+    x = random_state.rand(300, 5)
+    y = (x[:, 0] + 0.5 * random_state.rand(300) > 0.75).astype(int)
+
+    return x[:200], y[:200], x[200:], y[200:]
+
+
+@pytest.mark.parametrize('model', ensembles, ids=lambda model: type(model).__name__)
+def test_truncated_ensemble_equals_staged_prediction(dataset, model):
+    x_train, y_train, x_val, _ = dataset
+    n_estimators = [1, 5, 20]
+    model = model.fit(x_train, y_train)
+
+    for num_estimators, preds_proba in zip(n_estimators, hpo.get_staged_predict_proba(model, x_val, n_estimators)):
+        np.testing.assert_allclose(hpo.truncate_ensemble(model, num_estimators).predict_proba(x_val)[:, 1],
+                                   preds_proba)
+
+
+@pytest.mark.parametrize('model', ensembles, ids=lambda model: type(model).__name__)
+def test_ensemble_candidates_equal_separately_trained_ones(dataset, model):
+    n_estimators = [5, 20]
+    results = hpo.fit_score_ensemble(model, n_estimators, *dataset)
+
+    for num_estimators, (truncated_model, auc) in zip(n_estimators, results):
+        _, auc_separate = hpo.fit_score_sklearn(base.clone(model).set_params(n_estimators=num_estimators),
+                                                  *dataset)
+        assert len(truncated_model.estimators_) == num_estimators
+        assert auc == pytest.approx(auc_separate)
+
+
+def test_grid_search_keeps_grid_order(dataset):
+    grid = [{'n_estimators': n_estimators, 'random_state': 0} for n_estimators in [5, 20]]
+    candidates = [(grid, ensemble.RandomForestClassifier(random_state=0))]
+    fit_score = lambda model: hpo.fit_score_ensemble(model, [5, 20], *dataset)
+
+    _, best_hps, aucs = hpo.grid_search(fit_score, candidates, grid_order=grid[::-1])
+
+    assert aucs == [auc for _, auc in fit_score(candidates[0][1])][::-1]
+    assert best_hps == grid[::-1][int(np.flatnonzero(np.asarray(aucs) == max(aucs))[-1])]
+
+
+def test_successive_halving_keeps_best_candidates(dataset):
+    candidates = [({'c': c}, linear_model.LogisticRegression(C=c)) for c in [0.001, 0.01, 0.1, 1., 10., 100.]]
+    fit_score = lambda model, budget: hpo.fit_score_sklearn(model, *dataset, budget=budget)
+
+    _, best_hps, stages = hpo.successive_halving(fit_score, candidates, min_budget=1 / 4, eta=2)
+
+    assert [stage['budget'] for stage in stages] == [0.25, 0.5, 1.]
+    assert [len(stage['hps']) for stage in stages] == [6, 3, 2]
+    for stage, next_stage in zip(stages, stages[1:]):
+        best = np.argsort(-np.asarray(stage['aucs']), kind='stable')[:len(next_stage['hps'])]
+        assert next_stage['hps'] == [stage['hps'][idx] for idx in sorted(best)]
+    assert best_hps in stages[-1]['hps']
+
+
+def test_full_budget_trains_on_the_training_matrix_itself(dataset):
+    x_train, y_train, _, _ = dataset
+
+    assert hpo.get_training_subset(x_train, y_train, 1.)[0] is x_train
+    assert len(hpo.get_training_subset(x_train, y_train, 0.5)[0]) == len(x_train) // 2
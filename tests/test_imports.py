@@ -0,0 +1,31 @@
+"""
+Importing the modules must not load the heavy backends; they are only loaded by the code paths that use them
+(see util.lazy_import).
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+root = os.path.join(os.path.dirname(__file__), '..')
+
+# modules that must not load tensorflow or shap when they are imported
+modules = ['src.util', 'src.data', 'src.prefixes', 'src.features', 'src.hpo', 'src.kernels', 'src.artifacts',
+           'src.serving', 'src.streaming', 'src.load_test', 'src.main']
+heavy_modules = ['tensorflow', 'shap']
+
+# a module imported with util.lazy_import is in sys.modules as a placeholder until its first use, so only loaded
+# modules are counted
+probe = '''
+import sys
+import {module}
+print(",".join(m for m in {heavy_modules} if type(sys.modules.get(m)).__name__ == "module"))
+'''
+
+
+@pytest.mark.parametrize('module', modules)
+def test_import_does_not_load_heavy_modules(module):
+    output = subprocess.run([sys.executable, '-c', probe.format(module=module, heavy_modules=heavy_modules)],
+                            cwd=root, check=True, capture_output=True, text=True).stdout.strip()
+
+    assert output == ''
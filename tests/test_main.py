@@ -0,0 +1,44 @@
+import pickle
+import joblib
+import numpy as np
+import pytest
+import src.main as main
+
+
+@pytest.fixture(scope='module')
+def splits():
+    random_state = np.random.RandomState(0)
+    x_seq = (random_state.rand(150, 4, 3) > 0.7).astype(np.float32)
+    x_stat = random_state.rand(150, 2)
+    y = (x_seq[:, :, 0].sum(axis=1) + x_stat[:, 0] > 1.5).astype(int)
+
+    return [data for rows in [slice(0, 80), slice(80, 110), slice(110, 150)]
+            for data in (x_seq[rows], x_stat[rows], y[rows])]
+
+
+def test_settings_are_the_whitelisted_globals(monkeypatch):
+    monkeypatch.setitem(main.models, ('sepsis', 'lr', 'Admission IC'), {'model': lambda x: x, 'hps': {}})
+
+    settings = main.get_settings()
+
+    assert set(settings) <= set(main.worker_settings) and 'models' not in settings
+    assert pickle.loads(pickle.dumps(settings)) == settings
+
+
+def test_repetitions_are_reproducible_in_worker_processes(monkeypatch, tmp_path, splits):
+    (tmp_path / 'output').mkdir()
+    (tmp_path / 'src').mkdir()
+    monkeypatch.chdir(tmp_path / 'src')  # the hpos are written to ../output
+    monkeypatch.setattr(main, 'max_len', 4)
+    monkeypatch.setattr(main, 'target_activity', 'Admission IC', raising=False)
+    settings = main.get_settings()
+    hps = {"rf": {"num_trees": [5, 10], "max_depth_trees": [2], "num_rand_vars": [1]}}
+
+    run = joblib.delayed(main.run_repetition)
+    results = joblib.Parallel(n_jobs=2)(run(seed, "rf", hps, True, *splits, settings=settings) for seed in [1, 1, 2])
+    preds_proba = [result[3] for result in results]
+
+    np.testing.assert_array_equal(preds_proba[0], preds_proba[1])
+    np.testing.assert_array_equal(main.run_repetition(1, "rf", hps, True, *splits, settings=settings)[3],
+                                  preds_proba[0])
+    assert not np.array_equal(preds_proba[0], preds_proba[2])
@@ -0,0 +1,54 @@
+import concurrent.futures
+import numpy as np
+import pytest
+import src.kernels as kernels
+import src.serving as serving
+
+
+@pytest.fixture
+def service(lstm_model):
+    service = serving.PredictionService(lstm_model['model'], lstm_model['seq_features'],
+                                        lstm_model['static_features'], lstm_model['scalers'], lstm_model['max_len'],
+                                        max_delay=0.5)
+    yield service
+    service.close()
+
+
+def get_expected(lstm_model, pathways):
+    x_seq, x_stat = serving.encode_pathways(pathways, lstm_model['seq_features'], lstm_model['static_features'],
+                                            lstm_model['scalers'], lstm_model['max_len'])
+
+    return kernels.predict_lstm(lstm_model['model'].get_weights(), x_seq, x_stat, masking=True)
+
+
+def test_rejected_requests_do_not_stop_the_batch(lstm_model, pathways, service):
+    malformed = [dict(pathways[0], activities=['Unknown activity']), dict(pathways[1], crp=[]), 'no pathway',
+                 dict(pathways[2], activities=[])]
+    requests = [pathways[0], malformed[0], pathways[1], malformed[1], malformed[2], pathways[2], malformed[3],
+                pathways[3]]
+    batch = [(pathway, concurrent.futures.Future()) for pathway in requests]
+
+    service.predict_batch(batch)
+
+    futures = {id(pathway): future for pathway, future in batch}
+    for pathway in malformed:
+        assert isinstance(futures[id(pathway)].exception(0), (ValueError, TypeError))
+    np.testing.assert_allclose([futures[id(pathway)].result(0) for pathway in pathways],
+                               get_expected(lstm_model, pathways), rtol=1e-5)
+
+
+def test_service_keeps_serving_after_rejected_requests(lstm_model, pathways, service):
+    futures = [service.submit(pathway) for pathway in [pathways[0], {'activities': ['Unknown activity']}, pathways[3]]]
+
+    with pytest.raises(ValueError):
+        futures[1].result(10)
+    np.testing.assert_allclose([futures[0].result(10), futures[2].result(10)],
+                               get_expected(lstm_model, [pathways[0], pathways[3]]), rtol=1e-5)
+    assert service.predict(pathways[1]) == pytest.approx(get_expected(lstm_model, [pathways[1]])[0], rel=1e-5)
+
+
+def test_closed_service_rejects_requests(pathways, service):
+    service.close()
+
+    with pytest.raises(RuntimeError):
+        service.submit(pathways[0])
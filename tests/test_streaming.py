@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import src.kernels as kernels
+import src.serving as serving
+import src.streaming as streaming
+
+
+@pytest.fixture
+def scorer(lstm_model):
+    return streaming.StreamingScorer(lstm_model['model'], lstm_model['seq_features'], lstm_model['static_features'],
+                                     lstm_model['scalers'], lstm_model['max_len'], max_cases=2, max_idle=60)
+
+
+def add_event(scorer, case_id, pathway, idx, now=0):
+    """
+    Adds the event idx of a pathway to the case case_id of a scorer.
+    """
+    return scorer.add_event(case_id, pathway['activities'][idx], pathway['leucocytes'][idx], pathway['crp'][idx],
+                            pathway['lacticacid'][idx], statics=pathway['statics'] if idx == 0 else None, now=now)
+
+
+def add_events(scorer, case_id, pathway, now=0):
+    return [add_event(scorer, case_id, pathway, idx, now) for idx in range(len(pathway['activities']))]
+
+
+def test_scores_equal_predict_lstm(lstm_model, pathways, scorer):
+    pathway = pathways[-1]
+    prefixes = [dict(pathway, **{key: pathway[key][:length] for key in ['activities', 'leucocytes', 'crp',
+                                                                        'lacticacid']})
+                for length in range(1, len(pathway['activities']) + 1)]
+    x_seq, x_stat = serving.encode_pathways(prefixes, lstm_model['seq_features'], lstm_model['static_features'],
+                                            lstm_model['scalers'], lstm_model['max_len'])
+
+    np.testing.assert_allclose(add_events(scorer, 'case', pathway),
+                               kernels.predict_lstm(lstm_model['model'].get_weights(), x_seq, x_stat, masking=True))
+
+
+def test_interleaved_cases_keep_their_states(lstm_model, pathways, scorer):
+    single_scores = [add_events(scorer, idx, pathway) for idx, pathway in enumerate(pathways[2:])]
+    for case_id in [0, 1]:
+        scorer.close_case(case_id)
+
+    interleaved_scores = [[], []]
+    for idx in range(len(pathways[3]['activities'])):
+        for case_id, pathway in enumerate(pathways[2:]):
+            if idx < len(pathway['activities']):
+                interleaved_scores[case_id].append(add_event(scorer, case_id, pathway, idx))
+
+    for single, interleaved in zip(single_scores, interleaved_scores):
+        np.testing.assert_allclose(interleaved, single)
+
+
+def test_failed_event_leaves_no_state(pathways, scorer):
+    with pytest.raises(ValueError):
+        scorer.add_event('case', 'Unknown activity', statics=pathways[0]['statics'], now=0)
+
+    assert 'case' not in scorer.cases
+
+
+def test_cases_are_evicted(pathways, scorer):
+    for case_id in range(3):
+        add_events(scorer, case_id, pathways[0], now=case_id)
+    assert list(scorer.cases) == [1, 2]  # max_cases
+
+    add_events(scorer, 3, pathways[0], now=62)
+    assert list(scorer.cases) == [2, 3]  # case 1 idle for longer than max_idle
+
+
+def test_model_without_masking_is_rejected(lstm_model):
+    tf = pytest.importorskip('tensorflow')
+    seq_features, static_features = lstm_model['seq_features'], lstm_model['static_features']
+    input_layer_seq = tf.keras.layers.Input(shape=(lstm_model['max_len'], len(seq_features)))
+    hidden_layer = tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(units=4))(input_layer_seq)
+    model = tf.keras.models.Model(inputs=input_layer_seq, outputs=tf.keras.layers.Dense(1, name='output_layer')(
+        hidden_layer))
+
+    with pytest.raises(ValueError):
+        streaming.StreamingScorer(model, seq_features, static_features, lstm_model['scalers'], lstm_model['max_len'],
+                                  mode="sequential")